@@ -0,0 +1,245 @@
+from __future__ import annotations
+
+import asyncio
+import math
+import re
+import time
+from collections import deque
+
+from starlette.responses import JSONResponse
+
+from config import settings
+
+
+# Route classes, matched on "METHOD path"; ``{}`` matches one path segment.
+# Liveness routes bypass admission control entirely so that orchestrator
+# health checks keep passing while logins are queued or shed.
+LIVENESS_ROUTES = ["GET /health"]
+CHEAP_ROUTES = [
+    "GET /.well-known/jwks.json",
+    "GET /configuration",
+    "GET /metrics/{}",
+    "GET /auth/me",
+    "POST /auth/introspect",
+    "OPTIONS {any}",
+]
+# Password hashing, outbound provider calls, image processing.
+EXPENSIVE_ROUTES = [
+    "POST /auth/token",
+    "POST /auth/register",
+    "GET /auth/{}/callback",
+    "POST /auth/introspect/batch",
+    "POST /auth/avatar/complete",
+]
+# Streaming transfers that hold their slot for minutes; kept apart so they
+# never starve logins of expensive slots.
+BULK_ROUTES = [
+    "GET /admin/users/export",
+    "POST /admin/users/import",
+]
+
+
+def _compile(routes: list[str]) -> re.Pattern:
+    patterns = []
+    for route in routes:
+        method, path = route.split(" ", 1)
+        if path == "{any}":
+            patterns.append(re.escape(method) + r" .*")
+        else:
+            patterns.append(re.escape(method + " " + path).replace(r"\{\}", "[^/]+"))
+    return re.compile("|".join(f"(?:{pattern})" for pattern in patterns) + r"\Z")
+
+
+class RouteClass:
+    """Concurrency limit and queue for one class of routes.
+
+    Lower ``priority`` values are admitted first when slots free up.
+    """
+
+    def __init__(self, name: str, priority: int, limit: int, queue_size: int, queue_timeout: float):
+        self.name = name
+        self.priority = priority
+        self.limit = limit
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.waiters: deque[asyncio.Future] = deque()
+        self.shed = 0
+        # Smoothed seconds per request, for Retry-After estimates.
+        self.service_time = 0.1
+
+
+class Overloaded(Exception):
+    def __init__(self, retry_after: int):
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Global and per-class concurrency limits with priority queueing.
+
+    Runs entirely on the event loop thread and never awaits while changing
+    state, so no locking is needed. State is per worker.
+    """
+
+    def __init__(self, max_concurrency: int, classes: list[RouteClass]):
+        self.max_concurrency = max_concurrency
+        self.classes = {route_class.name: route_class for route_class in classes}
+        self._by_priority = sorted(classes, key=lambda route_class: route_class.priority)
+        self.active = 0
+
+    def _can_start(self, route_class: RouteClass) -> bool:
+        return self.active < self.max_concurrency and route_class.active < route_class.limit
+
+    def _start(self, route_class: RouteClass) -> None:
+        self.active += 1
+        route_class.active += 1
+
+    def _wake(self) -> None:
+        for route_class in self._by_priority:
+            while route_class.waiters and self._can_start(route_class):
+                waiter = route_class.waiters.popleft()
+                if not waiter.done():
+                    self._start(route_class)
+                    waiter.set_result(None)
+            if self.active >= self.max_concurrency:
+                return
+
+    def retry_after(self, route_class: RouteClass) -> int:
+        backlog = len(route_class.waiters) + route_class.active
+        return max(1, math.ceil(route_class.service_time * backlog / max(1, route_class.limit)))
+
+    async def acquire(self, route_class: RouteClass) -> None:
+        # Queue behind earlier waiters of the same class rather than jumping them.
+        if not route_class.waiters and self._can_start(route_class):
+            self._start(route_class)
+            return
+        if len(route_class.waiters) >= route_class.queue_size:
+            route_class.shed += 1
+            raise Overloaded(self.retry_after(route_class))
+        waiter = asyncio.get_running_loop().create_future()
+        route_class.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, route_class.queue_timeout)
+        except asyncio.TimeoutError:
+            # A slot granted just as the timeout fired is still ours; give it back.
+            if waiter.done() and not waiter.cancelled():
+                self.release(route_class, 0.0)
+            route_class.shed += 1
+            raise Overloaded(self.retry_after(route_class)) from None
+        except asyncio.CancelledError:
+            # Client went away while queued; give back a slot granted meanwhile.
+            if waiter.done() and not waiter.cancelled():
+                self.release(route_class, 0.0)
+            raise
+        finally:
+            if not waiter.done() or waiter.cancelled():
+                try:
+                    route_class.waiters.remove(waiter)
+                except ValueError:
+                    pass
+
+    def release(self, route_class: RouteClass, elapsed: float) -> None:
+        self.active -= 1
+        route_class.active -= 1
+        if elapsed:
+            route_class.service_time += 0.1 * (elapsed - route_class.service_time)
+        self._wake()
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active,
+            "max_concurrency": self.max_concurrency,
+            "classes": {
+                name: {
+                    "active": route_class.active,
+                    "limit": route_class.limit,
+                    "queued": len(route_class.waiters),
+                    "shed": route_class.shed,
+                    "service_time_ms": round(route_class.service_time * 1000, 1),
+                }
+                for name, route_class in self.classes.items()
+            },
+        }
+
+
+class AdmissionMiddleware:
+    """Pure ASGI middleware; holds a slot until the response has been sent."""
+
+    def __init__(self, app, controller: AdmissionController):
+        self.app = app
+        self.controller = controller
+        self._liveness = _compile(LIVENESS_ROUTES)
+        self._cheap = _compile(CHEAP_ROUTES)
+        self._expensive = _compile(EXPENSIVE_ROUTES)
+        self._bulk = _compile(BULK_ROUTES)
+
+    def classify(self, method: str, path: str) -> RouteClass | None:
+        route = f"{method} {path.rstrip('/') or '/'}"
+        if self._liveness.match(route):
+            return None
+        if self._cheap.match(route):
+            return self.controller.classes["cheap"]
+        if self._expensive.match(route):
+            return self.controller.classes["expensive"]
+        if self._bulk.match(route):
+            return self.controller.classes["bulk"]
+        return self.controller.classes["standard"]
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        route_class = self.classify(scope["method"], scope["path"])
+        if route_class is None:
+            await self.app(scope, receive, send)
+            return
+        try:
+            await self.controller.acquire(route_class)
+        except Overloaded as exc:
+            response = JSONResponse(
+                {"detail": "Server is busy, please retry"},
+                status_code=503,
+                headers={"Retry-After": str(exc.retry_after)},
+            )
+            await response(scope, receive, send)
+            return
+        started = time.monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(route_class, time.monotonic() - started)
+
+
+admission_controller = AdmissionController(
+    settings.admission_max_concurrency,
+    [
+        RouteClass(
+            "cheap",
+            0,
+            settings.admission_max_concurrency,
+            settings.admission_queue_size,
+            settings.admission_cheap_queue_timeout_seconds,
+        ),
+        RouteClass(
+            "standard",
+            1,
+            settings.admission_standard_concurrency,
+            settings.admission_queue_size,
+            settings.admission_queue_timeout_seconds,
+        ),
+        RouteClass(
+            "expensive",
+            2,
+            settings.admission_expensive_concurrency,
+            settings.admission_queue_size,
+            settings.admission_queue_timeout_seconds,
+        ),
+        RouteClass(
+            "bulk",
+            3,
+            settings.admission_bulk_concurrency,
+            settings.admission_queue_size,
+            settings.admission_queue_timeout_seconds,
+        ),
+    ],
+)
@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from datetime import datetime, timezone
+
+from config import settings
+from db import SessionLocal, lift_statement_timeout, raw_connection
+
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = ("user_id", "email", "provider", "ip", "success", "created_at")
+
+
+class AuditWriter:
+    """Buffers login events in memory and writes them in batches with COPY.
+
+    ``record`` only appends to a list, so it costs microseconds on the
+    request path. A background task flushes when ``audit_batch_size`` events
+    are waiting or every ``audit_flush_seconds``. Once ``audit_max_pending``
+    events are buffered, callers wait up to ``audit_backpressure_seconds``
+    for a flush before the event is dropped and counted in ``dropped``.
+    """
+
+    def __init__(self):
+        self._buffer: list[tuple] = []
+        self._flush_now = asyncio.Event()
+        self._drained = asyncio.Event()
+        self.dropped = 0
+
+    @property
+    def pending(self) -> int:
+        return len(self._buffer)
+
+    async def record(
+        self,
+        *,
+        provider: str,
+        success: bool,
+        email: str | None = None,
+        ip: str | None = None,
+        user_id=None,
+    ) -> None:
+        if not settings.audit_enabled:
+            return
+        if len(self._buffer) >= settings.audit_max_pending:
+            self._drained.clear()
+            self._flush_now.set()
+            try:
+                await asyncio.wait_for(self._drained.wait(), settings.audit_backpressure_seconds)
+            except asyncio.TimeoutError:
+                self.dropped += 1
+                return
+        self._buffer.append((user_id, email, provider, ip, success, datetime.now(timezone.utc)))
+        if len(self._buffer) >= settings.audit_batch_size:
+            self._flush_now.set()
+
+    async def flush(self) -> int:
+        if not self._buffer:
+            return 0
+        batch, self._buffer = self._buffer, []
+        self._drained.set()
+        try:
+            async with SessionLocal() as session:
+                conn = await raw_connection(session)
+                async with conn.transaction():
+                    await lift_statement_timeout(conn)
+                    await conn.copy_records_to_table("login_events", records=batch, columns=COLUMNS)
+        except asyncio.CancelledError:
+            # Cancelled mid-COPY (the transaction rolls back); keep the batch.
+            self._restore(batch)
+            raise
+        except Exception:
+            logger.exception("Writing %d audit events failed; will retry", len(batch))
+            self._restore(batch)
+            return 0
+        return len(batch)
+
+    def _restore(self, batch: list[tuple]) -> None:
+        # Put the batch back ahead of newer events, keeping the newest within the buffer limit.
+        keep = batch + self._buffer
+        overflow = len(keep) - settings.audit_max_pending
+        if overflow > 0:
+            self.dropped += overflow
+            keep = keep[overflow:]
+        self._buffer = keep
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_now.wait(), settings.audit_flush_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_now.clear()
+            await self.flush()
+
+
+audit_writer = AuditWriter()
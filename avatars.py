@@ -0,0 +1,137 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import io
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+from starlette.concurrency import run_in_threadpool
+
+from config import settings
+
+
+# Raw client uploads, keyed by day so a bucket lifecycle rule can expire them.
+AVATAR_UPLOAD_PREFIX = "uploads"
+ALLOWED_FORMATS = {"JPEG", "PNG", "GIF", "WEBP"}
+_CONTENT_TYPES = {"webp": "image/webp", "jpeg": "image/jpeg", "png": "image/png"}
+_EXTENSIONS = {"webp": "webp", "jpeg": "jpg", "png": "png"}
+# Keys are content addressed, so stored variants never change.
+_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def _new_avatar_executor() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=settings.avatar_workers, thread_name_prefix="avatar")
+
+
+# Pillow releases the GIL while decoding, resizing and encoding, so threads
+# give real parallelism without blocking the event loop.
+_avatar_executor = _new_avatar_executor()
+
+
+class AvatarError(ValueError):
+    pass
+
+
+def _render(data: bytes) -> tuple[str, dict[tuple[int, str], bytes]]:
+    # Pillow is imported on first use so workers that never see an avatar
+    # do not pay for it at startup.
+    from PIL import Image, ImageOps, UnidentifiedImageError
+
+    if len(data) > settings.avatar_max_bytes:
+        raise AvatarError("Image is too large")
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            if image.format not in ALLOWED_FORMATS:
+                raise AvatarError(f"Unsupported image format: {image.format}")
+            # Check dimensions from the header before decoding any pixels.
+            if image.width * image.height > settings.avatar_max_pixels:
+                raise AvatarError("Image dimensions are too large")
+            image.seek(0)
+            image = ImageOps.exif_transpose(image)
+            image = image.convert("RGBA" if "A" in image.getbands() or "transparency" in image.info else "RGB")
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError) as exc:
+        raise AvatarError("Invalid image") from exc
+
+    # Hash the decoded pixels rather than the upload, so the same picture
+    # with different metadata or encoding settings dedupes too.
+    digest = hashlib.sha256(f"{image.mode}:{image.width}x{image.height}:".encode("ascii"))
+    digest.update(image.tobytes())
+
+    variants: dict[tuple[int, str], bytes] = {}
+    for size in settings.avatar_sizes_list:
+        thumb = ImageOps.fit(image, (size, size), Image.Resampling.LANCZOS)
+        for fmt in settings.avatar_formats_list:
+            frame = thumb
+            if fmt == "jpeg" and frame.mode == "RGBA":
+                frame = Image.new("RGB", frame.size, (255, 255, 255))
+                frame.paste(thumb, mask=thumb.getchannel("A"))
+            out = io.BytesIO()
+            # Pixels are re-encoded from scratch; EXIF, ICC and text chunks are
+            # not carried over.
+            frame.save(out, format=fmt.upper(), quality=settings.avatar_quality, optimize=True)
+            variants[(size, fmt)] = out.getvalue()
+    return digest.hexdigest(), variants
+
+
+async def process_avatar(data: bytes) -> tuple[str, dict[tuple[int, str], bytes]]:
+    """Validate an image and render every configured size and format.
+
+    Returns the content hash and the encoded variants keyed by (size, format).
+    Raises ``AvatarError`` for anything that is not a reasonable image.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_avatar_executor, _render, data)
+
+
+def close_avatar_executor() -> None:
+    global _avatar_executor
+    _avatar_executor.shutdown(wait=False, cancel_futures=True)
+    _avatar_executor = _new_avatar_executor()
+
+
+def avatar_key(digest: str, size: int, fmt: str) -> str:
+    return f"avatars/{digest[:2]}/{digest}/{size}.{_EXTENSIONS[fmt]}"
+
+
+def _exists(client, key: str) -> bool:
+    try:
+        client.head_object(Bucket=settings.minio_bucket, Key=key)
+    except ClientError:
+        return False
+    return True
+
+
+async def store_avatar(client, data: bytes, source: str) -> dict:
+    """Process ``data`` and upload its variants, skipping already stored images."""
+    digest, variants = await process_avatar(data)
+    primary = next(iter(variants))
+    primary_key = avatar_key(digest, *primary)
+
+    def put(variant: tuple[int, str]):
+        return run_in_threadpool(
+            client.put_object,
+            Bucket=settings.minio_bucket,
+            Key=avatar_key(digest, *variant),
+            Body=variants[variant],
+            ContentType=_CONTENT_TYPES[variant[1]],
+            CacheControl=_CACHE_CONTROL,
+        )
+
+    if not await run_in_threadpool(_exists, client, primary_key):
+        await asyncio.gather(*(put(variant) for variant in variants if variant != primary))
+        # The primary key doubles as the "already stored" marker, so it goes
+        # last; an interrupted upload is redone in full next time.
+        await put(primary)
+    public_endpoint = (settings.minio_public_base_url or "").rstrip("/")
+    base = f"{public_endpoint}/{settings.minio_bucket}"
+    return {
+        "avatar_url": f"{base}/{primary_key}",
+        "avatar_object_key": primary_key,
+        "avatar_hash": digest,
+        "avatar_variants": {
+            str(size): {fmt: f"{base}/{avatar_key(digest, size, fmt)}" for fmt in settings.avatar_formats_list}
+            for size in settings.avatar_sizes_list
+        },
+        "avatar_source": source,
+    }
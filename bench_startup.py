@@ -0,0 +1,106 @@
+"""Cold-start benchmark for the API.
+
+    python bench_startup.py [--runs 5] [--top 15] [--budget-ms 1500]
+
+Prints the slowest imports of ``main`` (from ``python -X importtime``) and the
+time from spawning a uvicorn worker to its first successful ``/health``
+response, which is what an autoscaled worker costs before it is useful.
+With ``--budget-ms`` the script exits non-zero when the median time to first
+request is over budget. The app's usual environment variables (at least
+``SECRET_KEY`` and ``DATABASE_URL``) must be set.
+"""
+from __future__ import annotations
+
+import argparse
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+
+def import_profile(module: str = "main") -> list[tuple[int, int, str]]:
+    """(cumulative_us, depth, name) for every import made by ``import module``."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        sys.exit(f"import {module} failed:\n{result.stderr[-2000:]}")
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        rows.append((int(cumulative), (len(name) - len(name.lstrip())) // 2, name.strip()))
+    return rows
+
+
+def report_imports(module: str, top: int) -> None:
+    rows = import_profile(module)
+    total = next((cumulative for cumulative, _, name in rows if name == module), 0)
+    print(f"import {module}: {total / 1000:.0f} ms")
+    # Children of the module itself, i.e. what its own import statements cost.
+    depth = next(depth for _, depth, name in rows if name == module)
+    direct = sorted((row for row in rows if row[1] == depth + 1), reverse=True)[:top]
+    for cumulative, _, name in direct:
+        print(f"  {cumulative / 1000:7.1f} ms  {name}")
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def time_to_first_request(app: str = "main:app", timeout: float = 30.0) -> float:
+    """Seconds from spawning uvicorn to the first 200 from ``/health``."""
+    port = _free_port()
+    url = f"http://127.0.0.1:{port}/health"
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", app, "--port", str(port), "--log-level", "warning"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            if process.poll() is not None:
+                sys.exit(f"uvicorn exited early:\n{process.stderr.read().decode()[-2000:]}")
+            try:
+                with urllib.request.urlopen(url, timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - started
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.005)
+        sys.exit(f"no response from {url} within {timeout:.0f}s")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--budget-ms", type=float, default=None)
+    args = parser.parse_args()
+
+    report_imports(args.module, args.top)
+
+    samples = [time_to_first_request(f"{args.module}:app") for _ in range(args.runs)]
+    median = statistics.median(samples) * 1000
+    print(
+        f"time to first request: median {median:.0f} ms, "
+        f"min {min(samples) * 1000:.0f} ms, max {max(samples) * 1000:.0f} ms ({args.runs} runs)"
+    )
+    if args.budget_ms is not None and median > args.budget_ms:
+        sys.exit(f"over budget: {median:.0f} ms > {args.budget_ms:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
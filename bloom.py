@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import math
+import time
+from datetime import timedelta
+
+from sqlalchemy import func, select, text
+
+from config import settings
+from db import SessionLocal
+from models import User
+
+
+# updated_at is the writing transaction's start time, so a row can become
+# visible long after its timestamp (a slow import, say). The next refresh
+# starts no later than the oldest transaction that was writing when this one
+# ran, minus an overlap for writers that had not written anything yet.
+_HORIZON_QUERY = text(
+    "SELECT least(now(), min(xact_start)) FROM pg_stat_activity "
+    "WHERE backend_xid IS NOT NULL AND pid <> pg_backend_pid()"
+)
+_REFRESH_OVERLAP = timedelta(minutes=1)
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float):
+        capacity = max(capacity, 1)
+        self.capacity = capacity
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, item: str) -> None:
+        new = False
+        for pos in self._positions(item):
+            mask = 1 << (pos & 7)
+            if not self._bits[pos >> 3] & mask:
+                self._bits[pos >> 3] |= mask
+                new = True
+        # Re-adding a present item (refresh overlaps) does not use up capacity.
+        if new:
+            self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self._bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+
+class KnownEmails:
+    """Bloom filter over ``users.email`` used to answer unknown-email logins.
+
+    A miss means the email was not in the table when the filter was last
+    refreshed. Refreshes are incremental (by ``updated_at``, so imported users
+    and emails changed through SCIM are picked up too) and a miss on a filter
+    older than ``login_bloom_max_staleness_seconds`` refreshes first, so
+    accounts written by another worker are found within that window. Until
+    the first build completes every lookup is treated as a possible hit.
+    """
+
+    def __init__(self):
+        self._filter: BloomFilter | None = None
+        self._watermark = None
+        self._refreshed_at = 0.0
+        self._lock = asyncio.Lock()
+        # Emails added while a rebuild streams the table, which may have
+        # started reading before they were committed.
+        self._added_during_rebuild: list[str] | None = None
+
+    def add(self, email: str) -> None:
+        if self._added_during_rebuild is not None:
+            self._added_during_rebuild.append(email)
+        if self._filter is not None:
+            self._filter.add(email)
+
+    def invalidate(self) -> None:
+        """Force a full rebuild on the next refresh."""
+        self._watermark = None
+
+    async def might_exist(self, email: str) -> bool:
+        if not settings.login_bloom_enabled or self._filter is None:
+            return True
+        if email in self._filter:
+            return True
+        if time.monotonic() - self._refreshed_at > settings.login_bloom_max_staleness_seconds:
+            await self.refresh(max_age=settings.login_bloom_max_staleness_seconds)
+            return email in self._filter
+        return False
+
+    async def refresh(self, max_age: float | None = None) -> None:
+        async with self._lock:
+            if max_age is not None and time.monotonic() - self._refreshed_at <= max_age:
+                return
+            if self._watermark is None or self._filter is None or self._filter.count > self._filter.capacity:
+                await self._rebuild()
+                return
+            query = select(User.email).where(User.updated_at >= self._watermark - _REFRESH_OVERLAP)
+            started = time.monotonic()
+            async with SessionLocal() as session:
+                horizon = (await session.execute(_HORIZON_QUERY)).scalar_one()
+                emails = (await session.execute(query)).scalars().all()
+            for email in emails:
+                self._filter.add(email)
+            self._watermark = horizon
+            self._refreshed_at = started
+
+    async def _rebuild(self) -> None:
+        started = time.monotonic()
+        self._added_during_rebuild = []
+        try:
+            async with SessionLocal() as session:
+                horizon = (await session.execute(_HORIZON_QUERY)).scalar_one()
+                total = (await session.execute(select(func.count()).select_from(User))).scalar_one()
+                bloom = BloomFilter(max(settings.login_bloom_capacity, total * 2), settings.login_bloom_error_rate)
+                result = await session.stream(select(User.email).execution_options(yield_per=10_000))
+                async for partition in result.partitions():
+                    for (email,) in partition:
+                        bloom.add(email)
+            for email in self._added_during_rebuild:
+                bloom.add(email)
+        finally:
+            self._added_during_rebuild = None
+        self._filter = bloom
+        self._watermark = horizon
+        self._refreshed_at = started
+
+    async def run_refresher(self) -> None:
+        while True:
+            try:
+                await self.refresh()
+            except Exception:
+                # Keep serving from the last good filter; the DB may be briefly unavailable.
+                pass
+            await asyncio.sleep(settings.login_bloom_refresh_seconds)
+
+
+known_emails = KnownEmails()
@@ -0,0 +1,226 @@
+from __future__ import annotations
+
+import asyncio
+import csv
+import json
+import uuid
+from datetime import datetime, timezone
+from typing import AsyncIterator
+
+from pydantic import EmailStr, TypeAdapter, ValidationError
+
+from db import SessionLocal, lift_statement_timeout, raw_connection, read_sessionmaker
+from security import get_pwd_context, hash_password_async
+
+
+EXPORT_COLUMNS = (
+    "id",
+    "email",
+    "full_name",
+    "provider",
+    "provider_account_id",
+    "identity_data",
+    "is_active",
+    "created_at",
+)
+IMPORT_COLUMNS = ("hashed_password",) + EXPORT_COLUMNS
+IMPORT_BATCH_SIZE = 5_000
+MAX_REPORTED_ERRORS = 100
+
+# COPY in CSV mode with control characters as delimiter and quote leaves
+# row_to_json output untouched (JSON escapes all control characters), which
+# turns COPY into a raw NDJSON stream.
+_NDJSON_COPY_OPTIONS = {"format": "csv", "delimiter": "\x02", "quote": "\x01"}
+_CSV_COPY_OPTIONS = {"format": "csv", "header": True}
+_EMAIL = TypeAdapter(EmailStr)
+
+
+def _export_query(fmt: str) -> str:
+    columns = ", ".join(EXPORT_COLUMNS)
+    if fmt == "ndjson":
+        return f"SELECT row_to_json(u) FROM (SELECT {columns} FROM users ORDER BY created_at) u"
+    return f"SELECT {columns} FROM users ORDER BY created_at"
+
+
+async def export_users(fmt: str) -> AsyncIterator[bytes]:
+    """Stream all users as NDJSON or CSV straight from ``COPY ... TO STDOUT``.
+
+    COPY runs in its own task and hands chunks over through a small bounded
+    queue, so memory stays constant and a slow client slows the COPY down.
+    """
+    queue: asyncio.Queue[bytes | None] = asyncio.Queue(maxsize=16)
+    options = _NDJSON_COPY_OPTIONS if fmt == "ndjson" else _CSV_COPY_OPTIONS
+
+    async def run_copy() -> None:
+        cancelled = False
+        try:
+            async with read_sessionmaker()() as session:
+                conn = await raw_connection(session)
+                async with conn.transaction(readonly=True):
+                    await lift_statement_timeout(conn)
+                    await conn.copy_from_query(_export_query(fmt), output=queue.put, **options)
+        except asyncio.CancelledError:
+            # Only the reader cancels us, and it is gone: nobody would take
+            # the end marker off a full queue.
+            cancelled = True
+            raise
+        finally:
+            if not cancelled:
+                await queue.put(None)
+
+    task = asyncio.create_task(run_copy())
+    try:
+        while True:
+            chunk = await queue.get()
+            if chunk is None:
+                break
+            # asyncpg hands out memoryview/bytearray chunks.
+            yield bytes(chunk)
+        await task
+    finally:
+        task.cancel()
+        # Let the COPY unwind so its connection goes back to the pool.
+        await asyncio.gather(task, return_exceptions=True)
+
+
+async def _lines(stream: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    # Lines stay bytes: decoding happens per record, so invalid UTF-8 only
+    # fails the row it is in.
+    buffer = b""
+    async for chunk in stream:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line
+    if buffer:
+        yield buffer
+
+
+async def _csv_rows(lines: AsyncIterator[bytes]) -> AsyncIterator[dict | bytes]:
+    header = None
+    pending = b""
+    async for line in lines:
+        pending = pending + b"\n" + line if pending else line
+        # A record is complete once its quotes are balanced; quoted fields
+        # may contain newlines.
+        if pending.count(b'"') % 2:
+            continue
+        raw, pending = pending, b""
+        if header is None:
+            header = next(csv.reader([raw.decode("utf-8", errors="replace")]), None) or None
+            continue
+        try:
+            record = next(csv.reader([raw.decode("utf-8")]), [])
+        except UnicodeDecodeError:
+            # Handed on undecoded so _to_record reports it as a row error.
+            yield raw
+            continue
+        if record:
+            yield dict(zip(header, record))
+
+
+async def _ndjson_rows(lines: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    # Rows are decoded per record in _to_record so one bad line only skips itself.
+    async for line in lines:
+        if line.strip():
+            yield line
+
+
+def _parse_bool(value) -> bool:
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in {"t", "true", "1", "yes"}
+
+
+async def _to_record(row: dict | bytes) -> tuple:
+    if isinstance(row, bytes):
+        row = json.loads(row.decode("utf-8"))
+    if not isinstance(row, dict):
+        raise ValueError("expected a JSON object")
+    email = row.get("email") or ""
+    if not isinstance(email, str) or not email.strip():
+        raise ValueError("missing email")
+    try:
+        email = str(_EMAIL.validate_python(email.strip()))
+    except ValidationError:
+        raise ValueError(f"invalid email {email!r}")
+    hashed = row.get("hashed_password") or None
+    if hashed:
+        if not get_pwd_context().identify(hashed):
+            raise ValueError("unrecognised password hash format")
+    elif row.get("password"):
+        # Slow path: one hash per row. Prefer exporting hashes from the source IdP.
+        hashed = await hash_password_async(row["password"])
+    identity = row.get("identity_data") or {}
+    if isinstance(identity, str):
+        identity = json.loads(identity)
+    created_at = row.get("created_at")
+    if created_at in (None, ""):
+        created_at = datetime.now(timezone.utc)
+    elif not isinstance(created_at, str):
+        raise ValueError("created_at must be an ISO 8601 string")
+    else:
+        created_at = datetime.fromisoformat(created_at)
+        if created_at.tzinfo is None:
+            created_at = created_at.replace(tzinfo=timezone.utc)
+    is_active = row.get("is_active")
+    return (
+        hashed,
+        uuid.UUID(str(row["id"])) if row.get("id") else uuid.uuid4(),
+        email,
+        row.get("full_name") or None,
+        row.get("provider") or None,
+        row.get("provider_account_id") or None,
+        json.dumps(identity),
+        True if is_active in (None, "") else _parse_bool(is_active),
+        created_at,
+    )
+
+
+async def import_users(stream: AsyncIterator[bytes], fmt: str) -> dict:
+    """Load users from an NDJSON or CSV byte stream with ``COPY``.
+
+    Rows are copied in batches into a temporary table and then inserted in
+    one statement; existing emails or ids are skipped. Everything happens in
+    a single transaction, and memory use is bounded by one batch.
+    """
+    rows = _ndjson_rows(_lines(stream)) if fmt == "ndjson" else _csv_rows(_lines(stream))
+    received = 0
+    failed = 0
+    errors: list[dict] = []
+    async with SessionLocal() as session:
+        conn = await raw_connection(session)
+        async with conn.transaction():
+            await lift_statement_timeout(conn)
+            await conn.execute(
+                "CREATE TEMP TABLE users_import (LIKE users INCLUDING DEFAULTS) ON COMMIT DROP"
+            )
+            batch: list[tuple] = []
+            async for row in rows:
+                received += 1
+                try:
+                    batch.append(await _to_record(row))
+                except (KeyError, TypeError, ValueError) as exc:
+                    failed += 1
+                    if len(errors) < MAX_REPORTED_ERRORS:
+                        errors.append({"row": received, "error": str(exc)})
+                    continue
+                if len(batch) >= IMPORT_BATCH_SIZE:
+                    await conn.copy_records_to_table("users_import", records=batch, columns=IMPORT_COLUMNS)
+                    batch = []
+            if batch:
+                await conn.copy_records_to_table("users_import", records=batch, columns=IMPORT_COLUMNS)
+            columns = ", ".join(IMPORT_COLUMNS)
+            status = await conn.execute(
+                f"INSERT INTO users ({columns}) "
+                f"SELECT DISTINCT ON (email) {columns} FROM users_import ORDER BY email "
+                "ON CONFLICT DO NOTHING"
+            )
+    inserted = int(status.split()[-1])
+    return {
+        "received": received,
+        "inserted": inserted,
+        "skipped": received - inserted - failed,
+        "failed": failed,
+        "errors": errors,
+    }
@@ -0,0 +1,84 @@
+from __future__ import annotations
+
+import secrets
+import time
+from datetime import datetime
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import settings
+from db import scalar_one_or_primary
+from models import OAuthClient
+from ratelimit import _BoundedDict
+from revocation import revocation_list
+from security import create_client_token, hash_client_secret, verify_client_secret
+
+
+# client_id -> (OAuthClient, fetched at); avoids a DB hit per token request.
+# Unknown ids are not cached, so guessed client_ids cannot grow or churn it.
+_client_cache: _BoundedDict = _BoundedDict(settings.client_cache_size)
+# (client_id, scope) -> (token, expiry, jti); tokens are reused until close to
+# expiry or until they are revoked.
+_token_cache: dict[tuple[str, str], tuple[str, datetime, str]] = {}
+
+
+def client_scopes(client: OAuthClient) -> list[str]:
+    return client.scopes.split()
+
+
+async def register_client(session: AsyncSession, name: str, scopes: list[str]) -> tuple[OAuthClient, str]:
+    secret = secrets.token_urlsafe(32)
+    client = OAuthClient(
+        client_id=secrets.token_urlsafe(12),
+        name=name,
+        secret_hash=hash_client_secret(secret),
+        scopes=" ".join(scopes),
+    )
+    session.add(client)
+    await session.commit()
+    return client, secret
+
+
+async def _get_client(session: AsyncSession, client_id: str) -> OAuthClient | None:
+    cached = _client_cache.get(client_id)
+    if cached and time.monotonic() - cached[1] < settings.client_cache_seconds:
+        return cached[0]
+    client = await scalar_one_or_primary(session, select(OAuthClient).where(OAuthClient.client_id == client_id))
+    if client is None:
+        _client_cache.pop(client_id, None)
+    else:
+        _client_cache.put(client_id, (client, time.monotonic()))
+    return client
+
+
+async def authenticate_client(session: AsyncSession, client_id: str, client_secret: str) -> OAuthClient | None:
+    client = await _get_client(session, client_id)
+    if not client or not client.is_active:
+        return None
+    if not verify_client_secret(client_secret, client.secret_hash):
+        return None
+    return client
+
+
+def issue_client_token(client: OAuthClient, scopes: list[str]) -> tuple[str, int]:
+    """Return ``(token, expires_in)``, reusing a cached token with enough lifetime left."""
+    key = (client.client_id, " ".join(sorted(scopes)))
+    now = datetime.utcnow()
+    cached = _token_cache.get(key)
+    if (
+        cached
+        and (cached[1] - now).total_seconds() > settings.client_token_reuse_margin_seconds
+        and not revocation_list.is_revoked({"jti": cached[2]})
+    ):
+        return cached[0], int((cached[1] - now).total_seconds())
+    token, expire, jti = create_client_token(client.client_id, sorted(scopes))
+    _token_cache[key] = (token, expire, jti)
+    return token, int((expire - now).total_seconds())
+
+
+def forget_client_token(claims: dict) -> None:
+    """Stop handing out a cached client token once it has been revoked."""
+    jti = claims.get("jti")
+    for key in [key for key, cached in _token_cache.items() if cached[2] == jti]:
+        del _token_cache[key]
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+from pydantic import Field
 from pydantic_settings import BaseSettings
 
 
@@ -13,9 +14,85 @@ class Settings(BaseSettings):
     jwt_public_key: str | None = None
     jwt_issuer: str | None = None
     jwt_audience: str | None = None
+    client_token_expire_minutes: int = 60
+    client_token_reuse_margin_seconds: int = 300
+    client_cache_seconds: float = 60
+    client_cache_size: int = 1_000
+    client_secret_pepper: str | None = None
+    verified_token_cache_size: int = 10_000
+    token_revocation_enabled: bool = True
+    revocation_refresh_seconds: float = 10
+    introspection_batch_max: int = 500
     database_url: str
+    db_pool_size: int = 10
+    db_max_overflow: int = 5
+    db_pool_timeout: float = 10
+    db_pool_recycle: int = 1800
+    db_pool_pre_ping: bool = True
+    db_statement_cache_size: int = 500
+    db_statement_timeout_ms: int = 15000
+    db_command_timeout: float | None = None
+    db_max_connections: int = 100
+    database_replica_urls: str = ""
+    db_replica_max_lag_seconds: float = 5
+    db_replica_check_seconds: float = 5
+    db_read_your_writes_seconds: float = 10
     auto_create_tables: bool = False
+    response_compression: str = "gzip"
+    compression_minimum_size: int = 1024
+    admission_control_enabled: bool = True
+    admission_max_concurrency: int = 64
+    admission_standard_concurrency: int = 32
+    admission_expensive_concurrency: int = 8
+    admission_bulk_concurrency: int = 2
+    admission_queue_size: int = 256
+    admission_queue_timeout_seconds: float = 5
+    admission_cheap_queue_timeout_seconds: float = 1
+    shutdown_flush_seconds: float = 5
     allowed_origins: str = ""
+    admin_user_ids: str = ""
+    scim_bearer_token: str | None = None
+    scim_bulk_max_operations: int = 1000
+    scim_max_page_size: int = 200
+
+    outbox_sink: str = ""
+    outbox_relay: bool = True
+    outbox_batch_size: int = 500
+    outbox_poll_seconds: float = 5
+    outbox_claim_seconds: float = 60
+    outbox_webhook_secret: str | None = None
+
+    audit_enabled: bool = True
+    audit_batch_size: int = 1000
+    audit_flush_seconds: float = 2
+    audit_max_pending: int = 50_000
+    audit_backpressure_seconds: float = 0.05
+
+    password_schemes: str = "bcrypt"
+    bcrypt_rounds: int = 12
+    argon2_time_cost: int = 2
+    argon2_memory_cost: int = 19456
+    argon2_parallelism: int = 1
+    password_hash_workers: int = 4
+
+    login_rate_limit_enabled: bool = True
+    # Token bucket rates divide by these, so they must be positive.
+    login_ip_rate_per_minute: float = Field(30, gt=0)
+    login_ip_burst: int = Field(30, ge=1)
+    login_account_rate_per_minute: float = Field(10, gt=0)
+    login_account_burst: int = Field(10, ge=1)
+    login_lockout_threshold: int = 5
+    login_lockout_base_seconds: int = 30
+    login_lockout_max_seconds: int = 3600
+    login_failure_window_seconds: int = 900
+    rate_limit_redis_url: str | None = None
+    trust_forwarded_for: bool = False
+    login_bloom_enabled: bool = True
+    login_bloom_capacity: int = 100_000
+    login_bloom_error_rate: float = 0.01
+    login_bloom_refresh_seconds: float = 30
+    login_bloom_max_staleness_seconds: float = 2
+    login_dummy_hash: bool = True
 
     google_client_id: str | None = None
     google_client_secret: str | None = None
@@ -30,6 +107,14 @@ class Settings(BaseSettings):
     minio_secret_key: str | None = None
     minio_bucket: str = "pidp-avatars"
     minio_public_base_url: str = "/s3"
+    avatar_max_bytes: int = 5_000_000
+    avatar_max_pixels: int = 25_000_000
+    avatar_sizes: str = "256,64"
+    avatar_formats: str = "webp,jpeg"
+    avatar_quality: int = 82
+    avatar_workers: int = 2
+    avatar_upload_expires_seconds: int = 300
+    avatar_upload_retention_days: int = 1
 
     class Config:
         env_file = ".env"
@@ -41,6 +126,26 @@ class Settings(BaseSettings):
             return []
         return [origin.strip() for origin in self.allowed_origins.split(",") if origin.strip()]
 
+    @property
+    def admin_user_ids_list(self) -> list[str]:
+        return [user_id.strip().lower() for user_id in self.admin_user_ids.split(",") if user_id.strip()]
+
+    @property
+    def replica_urls_list(self) -> list[str]:
+        return [url.strip() for url in self.database_replica_urls.split(",") if url.strip()]
+
+    @property
+    def password_schemes_list(self) -> list[str]:
+        return [scheme.strip() for scheme in self.password_schemes.split(",") if scheme.strip()]
+
+    @property
+    def avatar_sizes_list(self) -> list[int]:
+        return sorted({int(size) for size in self.avatar_sizes.split(",") if size.strip()}, reverse=True)
+
+    @property
+    def avatar_formats_list(self) -> list[str]:
+        return [fmt.strip().lower() for fmt in self.avatar_formats.split(",") if fmt.strip()]
+
     def social_enabled(self, provider: str) -> bool:
         if provider == "google":
             return bool(self.google_client_id and self.google_client_secret)
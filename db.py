@@ -1,14 +1,335 @@
 from __future__ import annotations
 
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from collections import OrderedDict
+
+from fastapi import Request
+from sqlalchemy import exc, text
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
 from config import settings
 
 
-engine = create_async_engine(settings.database_url, echo=False, future=True)
+logger = logging.getLogger(__name__)
+
+
+class PoolMetrics:
+    """Counters for time spent waiting on pool checkout."""
+
+    slow_threshold = 0.1
+
+    def __init__(self, name: str):
+        self.name = name
+        self.checkouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.slow_checkouts = 0
+        self.timeouts = 0
+
+    def observe(self, waited: float) -> None:
+        self.checkouts += 1
+        self.wait_seconds += waited
+        if waited > self.max_wait_seconds:
+            self.max_wait_seconds = waited
+        if waited > self.slow_threshold:
+            self.slow_checkouts += 1
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    metrics: PoolMetrics | None = None
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            if self.metrics:
+                self.metrics.timeouts += 1
+            raise
+        finally:
+            if self.metrics:
+                self.metrics.observe(time.perf_counter() - started)
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+
+def _build_engine(url: str, name: str):
+    connect_args = {
+        # SQLAlchemy's and asyncpg's prepared statement caches; set to 0 behind pgbouncer.
+        "prepared_statement_cache_size": settings.db_statement_cache_size,
+        "statement_cache_size": settings.db_statement_cache_size,
+        "server_settings": {"application_name": settings.app_name},
+    }
+    if settings.db_statement_timeout_ms:
+        connect_args["server_settings"]["statement_timeout"] = str(settings.db_statement_timeout_ms)
+    if settings.db_command_timeout:
+        connect_args["command_timeout"] = settings.db_command_timeout
+    new_engine = create_async_engine(
+        url,
+        echo=False,
+        future=True,
+        poolclass=InstrumentedPool,
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_timeout=settings.db_pool_timeout,
+        pool_recycle=settings.db_pool_recycle,
+        pool_pre_ping=settings.db_pool_pre_ping,
+        connect_args=connect_args,
+    )
+    new_engine.pool.metrics = PoolMetrics(name)
+    return new_engine
+
+
+engine = _build_engine(settings.database_url, "primary")
 SessionLocal = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
 
 
 async def get_session() -> AsyncSession:
     async with SessionLocal() as session:
         yield session
+
+
+class Replica:
+    def __init__(self, url: str, name: str):
+        self.name = name
+        self.engine = _build_engine(url, name)
+        self.sessionmaker = async_sessionmaker(self.engine, expire_on_commit=False, class_=AsyncSession)
+        self.healthy = False
+        self.lag_seconds: float | None = None
+        # WAL position replayed as of the last health check.
+        self.replay_lsn: int | None = None
+
+
+replicas = [Replica(url, f"replica{index}") for index, url in enumerate(settings.replica_urls_list)]
+_replica_cursor = 0
+# Keys (hashed bearer tokens) that recently wrote and must read from the
+# primary until the stored deadline, so their own writes are visible.
+_primary_pins: OrderedDict[str, float] = OrderedDict()
+_MAX_PINS = 100_000
+# After a write the primary's WAL position is returned in this header and
+# cookie. A request echoing it is only served by a replica that has replayed
+# that far, whichever worker handles it.
+READ_AFTER_HEADER = "X-PIdP-Read-After"
+READ_AFTER_COOKIE = "pidp_read_after"
+
+# Replay lag is zero when the replica has replayed everything it received;
+# otherwise it is the age of the last replayed transaction.
+_LAG_QUERY = text(
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END, "
+    "pg_last_wal_replay_lsn()::text"
+)
+
+
+def _pin_key(token: str) -> str:
+    return hashlib.blake2b(token.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def pin_to_primary(token: str) -> None:
+    key = _pin_key(token)
+    _primary_pins[key] = time.monotonic() + settings.db_read_your_writes_seconds
+    _primary_pins.move_to_end(key)
+    if len(_primary_pins) > _MAX_PINS:
+        _primary_pins.popitem(last=False)
+
+
+def parse_lsn(value: str) -> int:
+    """``'16/B374D848'`` to a comparable integer; ValueError if malformed."""
+    high, _, low = value.strip().partition("/")
+    return (int(high, 16) << 32) | int(low, 16)
+
+
+async def write_lsn(session: AsyncSession) -> str:
+    """The primary's WAL position, taken after ``session`` committed."""
+    return (await session.execute(text("SELECT pg_current_wal_lsn()::text"))).scalar_one()
+
+
+def _read_after(request: Request) -> int | None:
+    value = request.headers.get(READ_AFTER_HEADER) or request.cookies.get(READ_AFTER_COOKIE)
+    if not value:
+        return None
+    try:
+        return parse_lsn(value)
+    except ValueError:
+        return None
+
+
+def _is_pinned(request: Request) -> bool:
+    authorization = request.headers.get("authorization", "")
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return False
+    deadline = _primary_pins.get(_pin_key(token))
+    if deadline is None:
+        return False
+    if deadline < time.monotonic():
+        _primary_pins.pop(_pin_key(token), None)
+        return False
+    return True
+
+
+def _pick_replica(min_lsn: int | None = None) -> Replica | None:
+    global _replica_cursor
+    healthy = [
+        replica
+        for replica in replicas
+        if replica.healthy
+        and (min_lsn is None or (replica.replay_lsn is not None and replica.replay_lsn >= min_lsn))
+    ]
+    if not healthy:
+        return None
+    _replica_cursor = (_replica_cursor + 1) % len(healthy)
+    return healthy[_replica_cursor]
+
+
+def read_sessionmaker(pinned: bool = False, min_lsn: int | None = None) -> async_sessionmaker:
+    replica = None if pinned else _pick_replica(min_lsn)
+    return replica.sessionmaker if replica else SessionLocal
+
+
+async def get_read_session(request: Request) -> AsyncSession:
+    """Session for read-only endpoints, served by a healthy replica if any.
+
+    Falls back to the primary when no replica is within the lag limit, the
+    caller wrote recently through this worker, or no replica has replayed the
+    position the caller echoes in ``READ_AFTER_HEADER``/``READ_AFTER_COOKIE``.
+    ``session.info["replica"]`` tells which was used.
+    """
+    maker = read_sessionmaker(pinned=_is_pinned(request), min_lsn=_read_after(request))
+    async with maker() as session:
+        session.info["replica"] = maker is not SessionLocal
+        yield session
+
+
+async def raw_connection(session: AsyncSession):
+    """The asyncpg connection behind ``session``, for COPY and other driver-only APIs."""
+    conn = await session.connection()
+    raw = await conn.get_raw_connection()
+    return raw.driver_connection
+
+
+async def lift_statement_timeout(conn) -> None:
+    """Disable ``DB_STATEMENT_TIMEOUT_MS`` for the current transaction only.
+
+    For bulk work (COPY, batch inserts and deletes) that legitimately runs
+    longer than any request should; ``conn`` is an asyncpg connection inside
+    a transaction.
+    """
+    await conn.execute("SET LOCAL statement_timeout = 0")
+
+
+async def scalar_one_or_primary(session: AsyncSession, query):
+    """Run ``query`` and retry on the primary if a replica has no row yet.
+
+    This only covers rows that do not exist on the replica yet; a stale row is
+    returned as is, which the read-after position guards against.
+    """
+    result = (await session.execute(query)).scalar_one_or_none()
+    if result is None and session.info.get("replica"):
+        async with SessionLocal() as primary:
+            result = (await primary.execute(query)).scalar_one_or_none()
+    return result
+
+
+async def one_or_primary(session: AsyncSession, query):
+    """Like ``scalar_one_or_primary`` for queries returning several columns."""
+    result = (await session.execute(query)).one_or_none()
+    if result is None and session.info.get("replica"):
+        async with SessionLocal() as primary:
+            result = (await primary.execute(query)).one_or_none()
+    return result
+
+
+async def check_replicas() -> None:
+    for replica in replicas:
+        try:
+            async with replica.engine.connect() as conn:
+                lag, replay_lsn = (await conn.execute(_LAG_QUERY)).one()
+        except Exception:
+            if replica.healthy:
+                logger.warning("Replica %s is unreachable; routing reads to the primary", replica.name)
+            replica.healthy = False
+            replica.lag_seconds = None
+            replica.replay_lsn = None
+            continue
+        lag = float(lag)
+        replica.lag_seconds = lag
+        replica.replay_lsn = parse_lsn(replay_lsn) if replay_lsn else None
+        replica.healthy = lag <= settings.db_replica_max_lag_seconds
+
+
+async def run_replica_monitor() -> None:
+    while True:
+        await check_replicas()
+        await asyncio.sleep(settings.db_replica_check_seconds)
+
+
+def _engines() -> list:
+    return [engine] + [replica.engine for replica in replicas]
+
+
+async def dispose_engines() -> None:
+    """Close every pooled connection so Postgres sees them go at once."""
+    for item in _engines():
+        await item.dispose()
+
+
+def pool_stats() -> dict:
+    stats = {}
+    for item in _engines():
+        pool = item.pool
+        metrics = pool.metrics
+        stats[metrics.name] = {
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+            "checked_in": pool.checkedin(),
+            "checkouts": metrics.checkouts,
+            "avg_wait_ms": round(metrics.wait_seconds / metrics.checkouts * 1000, 3) if metrics.checkouts else 0.0,
+            "max_wait_ms": round(metrics.max_wait_seconds * 1000, 3),
+            "slow_checkouts": metrics.slow_checkouts,
+            "timeouts": metrics.timeouts,
+        }
+    for replica in replicas:
+        stats[replica.name]["healthy"] = replica.healthy
+        stats[replica.name]["lag_seconds"] = replica.lag_seconds
+    return stats
+
+
+def log_pool_sizing() -> None:
+    """Warn when all workers together could open more connections than allowed."""
+    # Each replica has its own pool, so the primary's budget is what matters.
+    workers = int(os.getenv("WEB_CONCURRENCY") or 1)
+    per_worker = settings.db_pool_size + settings.db_max_overflow
+    total = workers * per_worker
+    # Leave headroom for superuser, migration and monitoring connections.
+    budget = int(settings.db_max_connections * 0.8)
+    if total > budget:
+        suggested = max(1, budget // workers)
+        logger.warning(
+            "DB pool sizing: %d workers x (%d pool + %d overflow) = %d connections exceeds %d (80%% of "
+            "DB_MAX_CONNECTIONS=%d); consider DB_POOL_SIZE + DB_MAX_OVERFLOW <= %d",
+            workers,
+            settings.db_pool_size,
+            settings.db_max_overflow,
+            total,
+            budget,
+            settings.db_max_connections,
+            suggested,
+        )
+    else:
+        logger.info(
+            "DB pool sizing: %d workers x %d connections = %d of %d available",
+            workers,
+            per_worker,
+            total,
+            budget,
+        )
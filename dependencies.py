@@ -0,0 +1,44 @@
+from __future__ import annotations
+
+import hmac
+import uuid
+
+from fastapi import Depends, HTTPException, status
+from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import settings
+from db import get_session
+from models import User
+from security import safe_decode_token
+
+
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/token")
+
+
+async def require_admin(token: str = Depends(oauth2_scheme), session: AsyncSession = Depends(get_session)) -> dict:
+    """Admin rights come from the users table (or ADMIN_USER_IDS), looked up by ``sub``.
+
+    Token claims such as ``email`` are not trusted for this: registration
+    does not prove ownership of an address.
+    """
+    payload = safe_decode_token(token)
+    if not payload or not payload.get("sub"):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+    try:
+        user_id = uuid.UUID(payload["sub"])
+    except ValueError:
+        # Client credential tokens ("client:<id>") are never admins.
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
+    # Always the primary: a revoked grant must not linger on a lagging replica.
+    user = await session.get(User, user_id)
+    if not user or not user.is_active or not (user.is_admin or str(user_id) in settings.admin_user_ids_list):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
+    return payload
+
+
+async def require_provisioning(token: str = Depends(oauth2_scheme), session: AsyncSession = Depends(get_session)) -> dict:
+    """Admin user tokens, or the static SCIM bearer token used by HR systems."""
+    if settings.scim_bearer_token and hmac.compare_digest(token, settings.scim_bearer_token):
+        return {"sub": "scim"}
+    return await require_admin(token, session)
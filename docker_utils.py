@@ -2,12 +2,18 @@ import docker
 import os
 import sys
 import shutil
+import hashlib
 import json
 import subprocess
 import time
 from datetime import datetime, timedelta
 from typing import Dict, Optional, Any, List, Type
 from pathlib import Path
+
+import logwatch
+import readiness
+import templating
+
 here = Path(os.path.abspath(os.path.dirname(__file__)))
 
 # if colima is installed, point socket to that
@@ -16,13 +22,28 @@ if os.path.exists(colima_socket_path):
     print("Colima socket detected. Attaching to that")
     os.environ["DOCKER_HOST"] = colima_socket_path
 
-DOCKER_CLIENT = docker.from_env()
+_docker_client = None
+
+
+def get_docker_client():
+    """The shared Docker client, connected on first use rather than at import."""
+    global _docker_client
+    if _docker_client is None:
+        _docker_client = docker.from_env()
+    return _docker_client
+
+
+def __getattr__(name):
+    # ``docker_utils.DOCKER_CLIENT`` still works for existing callers.
+    if name == "DOCKER_CLIENT":
+        return get_docker_client()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def list_containers(show_all: bool = False) -> str:
     """List Docker containers."""
     try:
-        containers = DOCKER_CLIENT.containers.list(all=show_all)
+        containers = get_docker_client().containers.list(all=show_all)
 
         if not containers:
             return "No containers found"
@@ -37,57 +58,52 @@ def list_containers(show_all: bool = False) -> str:
         return f"Error listing containers: {str(e)}"
 
 
-def _extract_log_patterns(logs: str) -> Dict[str, Any]:
-    """Analyze logs for common patterns and anomalies."""
-    lines = logs.split("\n")
-    analysis = {
-        "total_lines": len(lines),
-        "error_count": sum(1 for line in lines if "error" in line.lower()),
-        "warning_count": sum(1 for line in lines if "warn" in line.lower()),
-        "patterns": {},
-        "timestamps": [],
-    }
-
-    # Extract timestamps if they exist
+def _extract_log_patterns(lines, name: str = "") -> Dict[str, Any]:
+    """Analyze log lines for common patterns and anomalies in a single pass."""
+    stats = logwatch.LogStats(name)
     for line in lines:
-        try:
-            if line and len(line) > 20:
-                timestamp_str = line[:23]
-                timestamp = datetime.strptime(timestamp_str, "%Y-%m-%d %H:%M:%S.%f")
-                analysis["timestamps"].append(timestamp)
-        except (ValueError, IndexError):
-            continue
-
-    return analysis
+        stats.feed(line)
+    return {
+        "total_lines": stats.totals["lines"],
+        "error_count": stats.totals["errors"],
+        "warning_count": stats.totals["warnings"],
+        "auth_failure_count": stats.totals["auth_failures"],
+        "patterns": dict(stats.templates.most_common(20)),
+        "first_timestamp": datetime.utcfromtimestamp(stats.first_seen) if stats.first_seen else None,
+        "last_timestamp": datetime.utcfromtimestamp(stats.last_seen) if stats.last_seen else None,
+    }
 
 
 def analyze_logs(
-    self,
     container_name: str,
     time_range_minutes: Optional[int] = 60,
     filters: Optional[Dict[str, str]] = None,
     max_lines: Optional[int] = 1000,
 ) -> Dict[str, Any]:
-    """Analyze logs from a specific container with pattern detection."""
+    """Analyze logs from a specific container with pattern detection.
+
+    Logs are streamed and analyzed line by line rather than loaded whole.
+    """
     try:
-        container = DOCKER_CLIENT.containers.get(container_name)
+        container = get_docker_client().containers.get(container_name)
 
-        # Get logs with timestamp
         since = datetime.utcnow() - timedelta(minutes=time_range_minutes)
-        logs = container.logs(
-            since=since, until=datetime.utcnow(), timestamps=True, tail=max_lines
-        ).decode("utf-8")
-
-        # Apply filters if specified
-        if filters:
-            filtered_logs = []
-            for line in logs.split("\n"):
-                if all(value.lower() in line.lower() for value in filters.values()):
-                    filtered_logs.append(line)
-            logs = "\n".join(filtered_logs)
-
-        # Analyze logs
-        analysis = self._extract_log_patterns(logs)
+        chunks = container.logs(stream=True, since=since, timestamps=True, tail=max_lines or "all")
+        needles = [value.lower() for value in (filters or {}).values()]
+        preview: List[str] = []
+        preview_length = 0
+
+        def matching():
+            nonlocal preview_length
+            for line in logwatch.stream_lines(chunks):
+                if needles and not all(needle in line.lower() for needle in needles):
+                    continue
+                if preview_length < 1000:
+                    preview.append(line)
+                    preview_length += len(line) + 1
+                yield line
+
+        analysis = _extract_log_patterns(matching(), container_name)
 
         # Add container info
         container_info = container.attrs
@@ -98,10 +114,11 @@ def analyze_logs(
             "created": container_info["Created"],
         }
 
+        raw_logs = "\n".join(preview)
         return {
             "success": True,
             "analysis": analysis,
-            "raw_logs": logs if len(logs) < 1000 else f"{logs[:1000]}... (truncated)",
+            "raw_logs": raw_logs if len(raw_logs) < 1000 else f"{raw_logs[:1000]}... (truncated)",
         }
 
     except docker.errors.NotFound:
@@ -116,11 +133,11 @@ from docker.errors import NotFound, APIError
 def create_network(networkName):
     """Create Docker network if not exists"""
     try:
-        DOCKER_CLIENT.networks.get(networkName)
+        get_docker_client().networks.get(networkName)
         print(f"Network {networkName} already exists")
         return
     except:
-        DOCKER_CLIENT.networks.create(networkName)
+        get_docker_client().networks.create(networkName)
         print(f"Created Network {networkName}")
         return
 
@@ -128,10 +145,10 @@ def create_network(networkName):
 def ensure_network(network_name):
     """Ensure the Docker network exists."""
     try:
-        DOCKER_CLIENT.networks.get(network_name)
+        get_docker_client().networks.get(network_name)
         print(f"Network {network_name} already exists.")
     except NotFound:
-        DOCKER_CLIENT.networks.create(network_name)
+        get_docker_client().networks.create(network_name)
         print(f"Network {network_name} created.")
 
 
@@ -141,7 +158,7 @@ def debug_container(config):
 
     # Get the container if it exists
     try:
-        container = DOCKER_CLIENT.containers.get(container_name)
+        container = get_docker_client().containers.get(container_name)
         print(f"Container {container_name} is in status '{container.status}'")
 
         if container.status == "running":
@@ -167,12 +184,12 @@ def debug_container(config):
 
     # Now run it
     print("Starting container with debug configuration...")
-    DOCKER_CLIENT.containers.run(**config)
+    get_docker_client().containers.run(**config)
 
 
 def stop_container(container_name):
     try:
-        container = DOCKER_CLIENT.containers.get(container_name)
+        container = get_docker_client().containers.get(container_name)
         container.stop()
     except:
         print("Couldn't stop container {container_name}. Maybe its not running")
@@ -182,7 +199,7 @@ def run_container(config):
     container_name = config["name"]
     # Get the container
     try:
-        container = DOCKER_CLIENT.containers.get(container_name)
+        container = get_docker_client().containers.get(container_name)
         # Check the container status
         print(f"Container {container_name} is in status '{container.status}'")
         if container.status == "running":
@@ -199,79 +216,67 @@ def run_container(config):
         print(f"No container is running with name {container_name}")
     # Now run it
     print(f"Starting {container_name}")
-    return DOCKER_CLIENT.containers.run(**config)
+    return get_docker_client().containers.run(**config)
+
+
+CONFIG_HASH_LABEL = "pidp.config-hash"
+
+
+def config_hash(config, image_id=None):
+    """Stable hash of a container run config (and the image it runs)."""
+    payload = json.dumps({"config": config, "image": image_id}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def ensure_container(config):
+    """Start the container described by ``config`` unless an identical one runs.
+
+    The config hash (including the image id) is stored as a label. A running
+    container with the same hash is reused, a stopped one is restarted, and
+    anything else is replaced. Returns ``(container, action)`` where action is
+    "reused", "restarted" or "created".
+    """
+    name = config["name"]
+    try:
+        image_id = get_docker_client().images.get(config["image"]).id
+    except NotFound:
+        image_id = None
+    wanted = config_hash(config, image_id)
+    try:
+        container = get_docker_client().containers.get(name)
+    except NotFound:
+        container = None
+    if container is not None:
+        if container.labels.get(CONFIG_HASH_LABEL) == wanted:
+            if container.status == "running":
+                return container, "reused"
+            if container.status in ("created", "exited"):
+                container.start()
+                return container, "restarted"
+        print(f"Replacing {name} (status {container.status}, config changed or unknown)")
+        container.remove(force=True)
+    config = dict(config, labels={**config.get("labels", {}), CONFIG_HASH_LABEL: wanted})
+    return get_docker_client().containers.run(**config), "created"
 
 
 def wait_for_db(network, db_url, db_user="postgres", max_attempts=30, delay=2):
-    print(f"Using db_url: {db_url}")
-    print(f"Waiting for the database to respond on {db_url}...")
-    host, port = db_url.split(":")
+    """Wait until Postgres at ``db_url`` (``host:port`` or a full URL) accepts connections."""
+    host, port = readiness.parse_address(db_url, 5432)
+    print(f"Waiting for the database to respond on {host}:{port}...")
+    prober = readiness.Prober(get_docker_client(), network)
+    readiness.run_probes(
+        prober, {f"database {host}:{port}": prober.postgres(host, port, db_user)}, deadline=max_attempts * delay
+    )
 
-    while True:
-        try:
-            subprocess.run(
-                [
-                    "docker",
-                    "run",
-                    "--rm",
-                    "--network",
-                    network,
-                    "postgres:15-alpine",
-                    "sh",
-                    "-c",
-                    f"pg_isready -h {host} -p {port} -U {db_user} >/dev/null 2>&1",
-                ],
-                check=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-            )
-            print(f"The database is accepting connections on {db_url}!")
-            break
-        except subprocess.CalledProcessError:
-            print(
-                f"Still waiting for the database to accept connections on {db_url}..."
-            )
-            time.sleep(2)
 
 def wait_for_db_localhost(db_port=5432, db_user="postgres", max_attempts=30, delay=2):
-    """
-    Wait for a PostgreSQL database to become available on localhost using Docker with host networking.
-    
-    Args:
-        db_port (int): Port number where PostgreSQL is running
-        db_user (str): PostgreSQL user to connect as
-        max_attempts (int): Maximum number of connection attempts
-        delay (int): Delay in seconds between attempts
-    """
+    """Wait for PostgreSQL published on localhost:``db_port``; raises TimeoutError."""
     print(f"Waiting for the database to respond on localhost:{db_port}...")
-    
-    attempts = 0
-    while attempts < max_attempts:
-        try:
-            subprocess.run(
-                [
-                    "docker",
-                    "run",
-                    "--rm",
-                    "--network=host",
-                    "postgres:15-alpine",
-                    "pg_isready",
-                    "-h", "localhost",
-                    "-p", str(db_port),
-                    "-U", db_user
-                ],
-                check=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-            )
-            print(f"The database is accepting connections on localhost:{db_port}!")
-            break
-        except subprocess.CalledProcessError:
-            attempts += 1
-            if attempts >= max_attempts:
-                raise TimeoutError(f"Database did not become available after {max_attempts} attempts")
-            print(f"Still waiting for the database to accept connections on localhost:{db_port}...")
-            time.sleep(delay)
+    prober = readiness.Prober()
+    readiness.run_probes(
+        prober, {f"database localhost:{db_port}": prober.postgres("localhost", db_port, db_user)},
+        deadline=max_attempts * delay,
+    )
 
 def wait_for_mongo(network, db_url, db_user="admin", db_password="password", max_attempts=30, delay=2):
     print(f"Using db_url: {db_url}")
@@ -307,75 +312,21 @@ def wait_for_mongo(network, db_url, db_user="admin", db_password="password", max
 
     raise RuntimeError(f"MongoDB did not become ready after {max_attempts} attempts.")
   
-def wait_for_url(url, network):
-    # Create and start the container
-    stop_container("url_test")
-    run_container(
-        dict(
-            image="curlimages/curl:8.4.0",  # A stable, well-known curl image
-            name="url_test",
-            network=network,
-            environment={"TEST_URL": url},
-            command=[
-                "sh",
-                "-c",
-                """
-            while ! curl -fsS -k --connect-timeout 5 "$TEST_URL"; do
-                echo 'Waiting for service at' $TEST_URL
-                sleep 2
-            done
-            echo 'Service is up!'
-            """,
-            ],
-            detach=False,
-            remove=True,  # Automatically clean up the container after it stops
-        )
-    )
+def wait_for_url(url, network, timeout=300):
+    """Wait until ``url`` on ``network`` answers with a non-error status."""
+    prober = readiness.Prober(get_docker_client(), network)
+    readiness.run_probes(prober, {url: prober.http(url)}, deadline=timeout)
+
 
 def wait_for_port(host, port, network, retries=60, delay=2):
     """Wait until a TCP port on a container becomes reachable."""
-    stop_container("port_test")
-    run_container(
-        dict(
-            image="busybox:latest",
-            name="port_test",
-            network=network,
-            environment={"TARGET_HOST": host, "TARGET_PORT": str(port)},
-            command=[
-                "sh",
-                "-c",
-                textwrap.dedent(
-                    f"""
-                i=0
-                while [ $i -lt {retries} ]; do
-                    if nc -z -w 2 $TARGET_HOST $TARGET_PORT; then
-                        echo "Service $TARGET_HOST:$TARGET_PORT is reachable"
-                        exit 0
-                    fi
-                    echo "Waiting for service at $TARGET_HOST:$TARGET_PORT"
-                    i=$((i+1))
-                    sleep {delay}
-                done
-                echo "Timed out waiting for $TARGET_HOST:$TARGET_PORT"
-                exit 1
-                """
-                ),
-            ],
-            detach=False,
-            remove=True,
-        )
-    )
+    prober = readiness.Prober(get_docker_client(), network)
+    readiness.run_probes(prober, {f"{host}:{port}": prober.tcp(host, port)}, deadline=retries * delay)
 
-import os
-import docker
 
-DOCKER_CLIENT = docker.from_env()
 here = os.path.dirname(os.path.abspath(__file__))
-import docker
 import textwrap
 
-DOCKER_CLIENT = docker.from_env()
-
 def generateDevKeys(outdir):
     print("Generating simple self-signed certificate for NGINX...")
 
@@ -409,7 +360,7 @@ def generateDevKeys(outdir):
     """)
 
     try:
-        container = DOCKER_CLIENT.containers.run(
+        container = get_docker_client().containers.run(
             image="alpine:latest",
             name="nginx_cert_gen",
             command=["sh", "-c", command],
@@ -549,45 +500,13 @@ def writeViteEnv(env, output_file=os.path.join(here, "web", ".env")):
     print(f"Environment variables have been written to {pyoutfile}")
 
 
-def substitutions(currdir, env): 
-    if os.path.isdir(currdir):
-        try:
-            for file in os.listdir(currdir):
-                substitutions(os.path.join(currdir, file), env)
-        except:
-            print(f"Couldn't process {currdir}")
-    else:
-        if currdir.endswith(".template"):
-            print("Applying substitutions to " + currdir)
-            newFile = currdir.replace(".template","")
-            with open(currdir, 'r') as f:
-                templateText = f.read()
-            for k, v in vars(env).items():
-                templateText = templateText.replace("$"+k, str(v))
-                newFile = newFile.replace("$"+k, str(v)) # also templetize the filename (!)
-            print(f"Writing to {newFile}")
-            with open(newFile, 'w+') as f:
-                f.write(templateText)
-
-        if currdir.endswith(".default"):
-            newFile = currdir.replace(".default","")
-            if os.path.exists(newFile):
-                return
-            print("Applying substitutions to " + currdir)
-            with open(currdir, 'r') as f:
-                templateText = f.read()
-            for k, v in vars(env).items():
-                templateText = templateText.replace("$"+k, str(v))
-                newFile = newFile.replace("$"+k, str(v)) # also templetize the filename (!)
-            print(f"Writing to {newFile}")
-            with open(newFile, 'w+') as f:
-                f.write(templateText)
-
-        if currdir.endswith(".copy"):
-            newFile = currdir.replace(".copy","")
-            if not os.path.exists(newFile):
-                print(f"Copying {currdir} to {newFile}")
-                shutil.copy(currdir, newFile)
+def substitutions(currdir, env):
+    """Render .template/.default files and copy .copy files under currdir.
+
+    Incremental: see templating.py. Unchanged templates are not re-read and
+    unchanged outputs are not rewritten.
+    """
+    templating.render_tree(currdir, templating.env_values(env))
 
 def initializeFiles(srcdir = here):
     # Check if we are in a GitHub Actions environment
@@ -0,0 +1,60 @@
+from __future__ import annotations
+
+import re
+
+from fastapi import HTTPException, status
+from sqlalchemy import Select, select
+
+from models import User
+
+
+# Columns selectable through ``fields=``; mirrors schemas.UserPublic.
+USER_FIELDS = ("id", "email", "full_name", "provider", "identity_data", "is_active", "created_at")
+_KEY = re.compile(r"^[A-Za-z0-9_\-]{1,100}$")
+
+
+def parse_fields(spec: str) -> list[str]:
+    """Validate a comma-separated ``fields=`` value.
+
+    Entries are top-level user fields or ``identity_data.<key>``. Unknown
+    names are rejected with 400 rather than silently dropped.
+    """
+    fields: list[str] = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        name, _, key = item.partition(".")
+        if name not in USER_FIELDS or (key and (name != "identity_data" or not _KEY.match(key))):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unknown field: {item}")
+        if item not in fields:
+            fields.append(item)
+    if not fields:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="fields must not be empty")
+    if "identity_data" in fields:
+        # The whole document is selected anyway; drop redundant sub-keys.
+        fields = [item for item in fields if not item.startswith("identity_data.")]
+    return fields
+
+
+def user_projection(fields: list[str]) -> Select:
+    """SELECT only the requested columns; JSON keys are extracted in SQL."""
+    columns = []
+    for item in fields:
+        name, _, key = item.partition(".")
+        column = getattr(User, name)
+        columns.append((column[key] if key else column).label(item))
+    return select(*columns)
+
+
+def to_sparse(row, fields: list[str]) -> dict:
+    data: dict = {}
+    for item in fields:
+        value = row._mapping[item]
+        name, _, key = item.partition(".")
+        if key:
+            if value is not None:
+                data.setdefault(name, {})[key] = value
+        else:
+            data[name] = value
+    return data
@@ -0,0 +1,68 @@
+"""Gunicorn settings for the production serving profile.
+
+Every value can be overridden through the environment; worker count defaults
+to the CPUs available to the container.
+"""
+import os
+
+from uvicorn_worker import UvicornWorker
+
+
+def _cpu_count() -> int:
+    # Honour cgroup v2 CPU quotas so a container limited to 2 CPUs on a
+    # 64-core host does not start 64 workers.
+    try:
+        quota, period = open("/sys/fs/cgroup/cpu.max").read().split()
+        if quota != "max":
+            return max(1, int(int(quota) / int(period)))
+    except (OSError, ValueError):
+        pass
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY") or _cpu_count())
+# Exported so the app can size per-worker resources such as DB pools.
+os.environ["WEB_CONCURRENCY"] = str(workers)
+preload_app = True
+
+# Recycle workers gradually to bound memory growth; jitter avoids all
+# workers restarting at once.
+max_requests = int(os.getenv("MAX_REQUESTS", "10000"))
+max_requests_jitter = int(os.getenv("MAX_REQUESTS_JITTER", "1000"))
+# On SIGTERM a worker has graceful_timeout seconds before it is killed. uvicorn
+# first stops accepting connections and waits for in-flight requests, then
+# runs the app's shutdown, which flushes buffers for up to
+# SHUTDOWN_FLUSH_SECONDS and closes the pools. Cap the request wait so that
+# both fit; requests still running after it are cancelled.
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+# Flush budget plus a little for closing clients and disposing the pools.
+_shutdown_seconds = float(os.getenv("SHUTDOWN_FLUSH_SECONDS", "5")) + 2
+timeout = int(os.getenv("WORKER_TIMEOUT", "60"))
+keepalive = int(os.getenv("KEEP_ALIVE", "5"))
+backlog = int(os.getenv("BACKLOG", "2048"))
+
+accesslog = os.getenv("ACCESS_LOG") or None
+errorlog = "-"
+
+
+class Worker(UvicornWorker):
+    CONFIG_KWARGS = {
+        **UvicornWorker.CONFIG_KWARGS,
+        "timeout_graceful_shutdown": max(1, graceful_timeout - _shutdown_seconds),
+    }
+
+
+# uvicorn's worker picks uvloop and httptools, which uvicorn[standard] installs.
+worker_class = Worker
+
+
+def when_ready(server):
+    # The app is imported in the master (preload_app); load or generate the
+    # JWT signing keys here so every forked worker signs with the same key.
+    import security
+
+    security._load_or_generate_keys()
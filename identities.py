@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import uuid
+
+from sqlalchemy import Boolean, column, func, select, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import ProviderProfile, User
+
+
+# Result columns are matched to User by position, and columns added to an
+# existing table by ALTER TABLE sit after created_at, so they are always
+# listed explicitly in model order rather than with ``*``.
+_USER_COLUMNS = [user_column.name for user_column in User.__table__.columns]
+
+
+def _columns(table: str) -> str:
+    return ", ".join(f"{table}.{name}" for name in _USER_COLUMNS)
+
+
+# Resolves a social login in one round trip: the linked identity wins, then
+# an existing account with the same email, otherwise a new user is created.
+# The identity link is upserted in the same statement. All lookups are index
+# scans (user_identities primary key, users.email).
+_RESOLVE_SQL = text(
+    f"""
+    WITH linked AS (
+        SELECT user_id FROM user_identities
+        WHERE provider = :provider AND provider_account_id = :account_id
+    ),
+    by_email AS (
+        SELECT id FROM users
+        WHERE email = :email AND NOT EXISTS (SELECT 1 FROM linked)
+    ),
+    new_user AS (
+        INSERT INTO users (id, email, full_name, provider, provider_account_id, identity_data, is_active, created_at)
+        SELECT CAST(:new_id AS uuid), CAST(:email AS varchar), CAST(:full_name AS varchar),
+               CAST(:provider AS varchar), CAST(:account_id AS varchar), '{{}}'::jsonb, true, now()
+        WHERE NOT EXISTS (SELECT 1 FROM linked) AND NOT EXISTS (SELECT 1 FROM by_email)
+        ON CONFLICT (email) DO NOTHING
+        RETURNING {_columns("users")}
+    ),
+    link AS (
+        INSERT INTO user_identities (provider, provider_account_id, user_id, created_at)
+        SELECT CAST(:provider AS varchar), CAST(:account_id AS varchar), id, now()
+        FROM (SELECT id FROM by_email UNION ALL SELECT id FROM new_user) AS resolved
+        ON CONFLICT (provider, provider_account_id) DO NOTHING
+    )
+    SELECT {_columns("users")}, false AS created FROM users JOIN linked ON users.id = linked.user_id
+    UNION ALL
+    SELECT {_columns("users")}, false FROM users JOIN by_email ON users.id = by_email.id
+    UNION ALL
+    SELECT {_columns("new_user")}, true FROM new_user
+    """
+)
+
+_BACKFILL_SQL = text(
+    """
+    INSERT INTO user_identities (provider, provider_account_id, user_id, created_at)
+    SELECT provider, provider_account_id, id, created_at FROM users
+    WHERE provider IS NOT NULL AND provider_account_id IS NOT NULL
+      AND NOT EXISTS (SELECT 1 FROM user_identities)
+    ON CONFLICT DO NOTHING
+    """
+)
+
+
+async def resolve_social_user(
+    session: AsyncSession,
+    provider: str,
+    account_id: str,
+    email: str,
+    full_name: str | None,
+) -> tuple[User, bool]:
+    """Return the user for a social login and whether it was just created."""
+    statement = select(User, column("created", Boolean)).from_statement(
+        _RESOLVE_SQL.columns(*User.__table__.columns, column("created", Boolean))
+    )
+    params = {
+        "provider": provider,
+        "account_id": account_id,
+        "email": email,
+        "full_name": full_name,
+    }
+    # A concurrent first login with the same email makes the INSERT a no-op
+    # and returns no row; the retry then finds that account by email.
+    for _ in range(2):
+        row = (await session.execute(statement, {**params, "new_id": uuid.uuid4()})).first()
+        if row:
+            return row[0], row[1]
+    raise RuntimeError(f"Could not resolve {provider} account {account_id}")
+
+
+async def backfill_identities(session: AsyncSession) -> int:
+    """Link users that predate ``user_identities`` by their provider columns.
+
+    Only runs while the table is empty, so it is a no-op after the first
+    start. Later accounts without a link are linked on login by email.
+    """
+    result = await session.execute(_BACKFILL_SQL)
+    await session.commit()
+    return result.rowcount
+
+
+async def store_provider_profile(session: AsyncSession, user_id: uuid.UUID, provider: str, profile: dict) -> None:
+    """Upsert the raw provider profile, writing only when its content changed."""
+    encoded = json.dumps(profile, sort_keys=True, separators=(",", ":"), default=str)
+    profile_hash = hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+    statement = insert(ProviderProfile).values(
+        user_id=user_id, provider=provider, profile=profile, profile_hash=profile_hash, updated_at=func.now()
+    )
+    await session.execute(
+        statement.on_conflict_do_update(
+            index_elements=[ProviderProfile.user_id, ProviderProfile.provider],
+            set_={
+                "profile": statement.excluded.profile,
+                "profile_hash": statement.excluded.profile_hash,
+                "updated_at": statement.excluded.updated_at,
+            },
+            # An unchanged profile leaves the row, and the WAL, untouched.
+            where=ProviderProfile.profile_hash != statement.excluded.profile_hash,
+        )
+    )
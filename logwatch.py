@@ -0,0 +1,213 @@
+"""Streaming analysis of container logs.
+
+Lines are processed one at a time as Docker streams them, so memory stays
+bounded no matter how much a container logs. Each line is classified
+(error, warning, auth failure), its message is reduced to a template with
+variable parts masked out, and counts are kept in fixed-size structures:
+per-second buckets for a rolling window and a capped template counter.
+
+    python logwatch.py [prefix]
+
+follows ``<prefix>pidp`` and ``<prefix>pidpdb`` and prints a summary of the
+last minute every ten seconds.
+"""
+from __future__ import annotations
+
+import calendar
+import re
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+
+_ERROR = re.compile(r"\b(?:ERROR|FATAL|PANIC|CRITICAL|Traceback)\b|\berror\b", re.IGNORECASE)
+_WARNING = re.compile(r"\bWARN(?:ING)?\b", re.IGNORECASE)
+# uvicorn access log: ... "POST /auth/token HTTP/1.1" 401
+_ACCESS = re.compile(r'"[A-Z]+ (?P<path>\S+) HTTP/[\d.]+" (?P<status>\d{3})')
+_AUTH_FAILURE_STATUSES = {"401", "403", "429"}
+# Postgres: FATAL:  password authentication failed for user "x"
+_PG_AUTH_FAILURE = re.compile(r"authentication failed|no pg_hba\.conf entry")
+# Variable parts of a message, masked so that similar lines share a template.
+_VARIABLE = re.compile(
+    r"(?P<time>\b\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2}(?:\.\d+)?(?: ?(?:UTC|Z|[+-]\d{2}:?\d{2}))?)"
+    r"|(?P<uuid>\b[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\b)"
+    r"|(?P<email>\b[\w.+-]+@[\w-]+\.[\w.-]+\b)"
+    r"|(?P<ip>\b\d{1,3}(?:\.\d{1,3}){3}(?::\d+)?\b)"
+    r"|(?P<quoted>\"[^\"]*\"|'[^']*')"
+    r"|(?P<hex>\b0x[0-9a-f]+\b|\b[0-9a-f]{16,}\b)"
+    r"|(?P<number>\b\d+(?:\.\d+)?\b)",
+    re.IGNORECASE,
+)
+_MAX_TEMPLATE_LENGTH = 200
+
+_second_cache: dict[str, int] = {}
+
+
+def parse_timestamp(line: str) -> float | None:
+    """Parse Docker's ``2024-05-01T12:00:00.123456789Z`` prefix to epoch seconds.
+
+    Fixed offsets instead of ``strptime``; whole seconds are cached because
+    consecutive lines almost always share them.
+    """
+    if len(line) < 20 or line[4] != "-" or line[10] != "T":
+        return None
+    prefix = line[:19]
+    seconds = _second_cache.get(prefix)
+    if seconds is None:
+        try:
+            seconds = calendar.timegm(
+                (int(line[0:4]), int(line[5:7]), int(line[8:10]), int(line[11:13]), int(line[14:16]), int(line[17:19]))
+            )
+        except ValueError:
+            return None
+        if len(_second_cache) > 4096:
+            _second_cache.clear()
+        _second_cache[prefix] = seconds
+    fraction = 0.0
+    if line[19] == ".":
+        end = line.find("Z", 20, 30)
+        digits = line[20:end] if end != -1 else ""
+        if digits.isdigit():
+            fraction = int(digits[:6]) / 10 ** len(digits[:6])
+    return seconds + fraction
+
+
+def template(message: str) -> str:
+    masked = _VARIABLE.sub(lambda match: f"<{match.lastgroup}>", message.strip())
+    return masked[:_MAX_TEMPLATE_LENGTH]
+
+
+class BoundedCounter:
+    """Approximate top-k counter holding at most ``capacity`` keys.
+
+    When full, the less frequent half is dropped, so frequent templates keep
+    exact-ish counts while the long tail cannot grow memory.
+    """
+
+    def __init__(self, capacity: int = 1000):
+        self.capacity = capacity
+        self.counts: Counter[str] = Counter()
+        self.dropped = 0
+
+    def add(self, key: str) -> None:
+        if key not in self.counts and len(self.counts) >= self.capacity:
+            keep = self.counts.most_common(self.capacity // 2)
+            self.dropped += sum(self.counts.values()) - sum(count for _, count in keep)
+            self.counts = Counter(dict(keep))
+        self.counts[key] += 1
+
+    def most_common(self, n: int) -> list[tuple[str, int]]:
+        return self.counts.most_common(n)
+
+
+class LogStats:
+    """Counters for one container over a rolling window of ``window`` seconds."""
+
+    _FIELDS = ("lines", "errors", "warnings", "auth_failures")
+
+    def __init__(self, name: str, window: int = 60, max_templates: int = 1000):
+        self.name = name
+        self.window = window
+        self.totals = dict.fromkeys(self._FIELDS, 0)
+        self.first_seen: float | None = None
+        self.last_seen: float | None = None
+        self.templates = BoundedCounter(max_templates)
+        self._buckets: deque[list] = deque()  # [second, lines, errors, warnings, auth_failures]
+        self._lock = threading.Lock()
+
+    def feed(self, line: str) -> None:
+        if not line:
+            return
+        stamp = parse_timestamp(line)
+        message = line[line.index(" ") + 1 :] if stamp is not None and " " in line else line
+        if stamp is None:
+            stamp = time.time()
+        is_error = bool(_ERROR.search(message))
+        is_warning = not is_error and bool(_WARNING.search(message))
+        access = _ACCESS.search(message)
+        is_auth_failure = bool(
+            (access and access.group("status") in _AUTH_FAILURE_STATUSES) or _PG_AUTH_FAILURE.search(message)
+        )
+        if access and access.group("status").startswith("5"):
+            is_error = True
+        with self._lock:
+            self.first_seen = stamp if self.first_seen is None else self.first_seen
+            self.last_seen = stamp
+            second = int(stamp)
+            if not self._buckets or self._buckets[-1][0] != second:
+                self._buckets.append([second, 0, 0, 0, 0])
+                self._expire(second)
+            bucket = self._buckets[-1]
+            for index, flag in enumerate((True, is_error, is_warning, is_auth_failure), start=1):
+                if flag:
+                    bucket[index] += 1
+                    self.totals[self._FIELDS[index - 1]] += 1
+            if is_error or is_warning or is_auth_failure:
+                self.templates.add(template(message))
+
+    def _expire(self, now: int) -> None:
+        while self._buckets and self._buckets[0][0] <= now - self.window:
+            self._buckets.popleft()
+
+    def rolling(self) -> dict[str, int]:
+        with self._lock:
+            self._expire(int(time.time()))
+            sums = [sum(bucket[index] for bucket in self._buckets) for index in range(1, 5)]
+        return dict(zip(self._FIELDS, sums))
+
+    def summary(self, top: int = 3) -> str:
+        window = self.rolling()
+        rate = window["auth_failures"] / self.window
+        parts = [
+            f"[{self.name}] last {self.window}s: {window['lines']} lines",
+            f"{window['errors']} errors",
+            f"{window['warnings']} warnings",
+            f"{window['auth_failures']} auth failures ({rate:.2f}/s)",
+        ]
+        with self._lock:
+            common = self.templates.most_common(top)
+        lines = [", ".join(parts)]
+        lines.extend(f"    {count:>6}x {text}" for text, count in common)
+        return "\n".join(lines)
+
+
+def stream_lines(chunks):
+    """Split a stream of byte chunks into decoded lines."""
+    buffer = b""
+    for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line.decode("utf-8", errors="replace").rstrip("\r")
+    if buffer:
+        yield buffer.decode("utf-8", errors="replace")
+
+
+def follow(container, stats: LogStats, since: int | None = None) -> None:
+    """Feed ``stats`` from a container's log stream until the container stops."""
+    chunks = container.logs(stream=True, follow=True, timestamps=True, since=since or int(time.time()))
+    for line in stream_lines(chunks):
+        stats.feed(line)
+
+
+def watch(client, names: list[str], interval: float = 10, window: int = 60) -> None:
+    """Follow several containers and print rolling summaries every ``interval`` seconds."""
+    stats = [LogStats(name, window) for name in names]
+    for item in stats:
+        container = client.containers.get(item.name)
+        threading.Thread(target=follow, args=(container, item, int(time.time()) - window), daemon=True).start()
+    try:
+        while True:
+            time.sleep(interval)
+            for item in stats:
+                print(item.summary())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    from docker_utils import get_docker_client
+
+    prefix = sys.argv[1] if len(sys.argv) > 1 else ""
+    watch(get_docker_client(), [prefix + "pidp", prefix + "pidpdb"])
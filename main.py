@@ -1,30 +1,97 @@
 from __future__ import annotations
 
+import asyncio
+import base64
 import json
+import logging
+import math
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
 from uuid import uuid4
 
-import boto3
 from botocore.exceptions import ClientError
-from fastapi import Depends, FastAPI, HTTPException, Request, status
+from fastapi import BackgroundTasks, Depends, FastAPI, Form, HTTPException, Request, Response, status
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from sqlalchemy import select
+from fastapi.middleware.gzip import GZipMiddleware
+from sqlalchemy import select, text
 from sqlalchemy.ext.asyncio import AsyncSession
 from starlette.concurrency import run_in_threadpool
 from starlette.middleware.sessions import SessionMiddleware
-from starlette.responses import JSONResponse, RedirectResponse
-from urllib.parse import urlencode
-import httpx
-
+from starlette.responses import JSONResponse, RedirectResponse, StreamingResponse
+from urllib.parse import unquote, urlencode
+
+from admission import AdmissionMiddleware, admission_controller
+from audit import audit_writer
+from avatars import AVATAR_UPLOAD_PREFIX, AvatarError, close_avatar_executor, store_avatar
+from bloom import known_emails
+from bulk import export_users, import_users
+from clients import authenticate_client, client_scopes, forget_client_token, issue_client_token, register_client
 from config import settings
-from db import engine, get_session
-from models import Base, User
-from oauth import fetch_social_profile, oauth
-from schemas import Token, UserCreate, UserPublic, UserProfileUpdate, UserPublicProfile
-from security import authenticate_user, create_access_token, hash_password, safe_decode_token, get_jwks
+from db import (
+    READ_AFTER_COOKIE,
+    READ_AFTER_HEADER,
+    SessionLocal,
+    dispose_engines,
+    engine,
+    get_read_session,
+    get_session,
+    log_pool_sizing,
+    one_or_primary,
+    pin_to_primary,
+    pool_stats,
+    replicas,
+    run_replica_monitor,
+    scalar_one_or_primary,
+    write_lsn,
+)
+from dependencies import oauth2_scheme, require_admin
+from fields import parse_fields, to_sparse, user_projection
+from identities import backfill_identities, resolve_social_user, store_provider_profile
+from models import Base, OAuthClient, User
+from oauth import fetch_social_profile, get_oauth
+from outbox import USER_CREATED, USER_UPDATED, outbox_relay, record_user_event
+from presign import PostPolicySigner
+from ratelimit import login_limiter
+from revocation import revocation_list
+from scim import router as scim_router
+from schemas import (
+    AvatarUploadComplete,
+    ClientCreate,
+    ClientCredentials,
+    IntrospectionBatch,
+    Token,
+    UserCreate,
+    UserPublic,
+    UserProfileUpdate,
+    UserPublicProfile,
+)
+from security import (
+    authenticate_user,
+    close_hash_executor,
+    create_access_token,
+    get_jwks,
+    hash_password_async,
+    introspect_token,
+    password_needs_rehash,
+    rehash_password,
+    safe_decode_token,
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await startup()
+    try:
+        yield
+    finally:
+        await shutdown()
 
 
-app = FastAPI(title=settings.app_name)
+app = FastAPI(title=settings.app_name, lifespan=lifespan)
 
 
 def _load_pidp_editme():
@@ -44,25 +111,72 @@ if settings.origins_list:
     )
 
 app.add_middleware(SessionMiddleware, secret_key=settings.secret_key)
+if settings.response_compression == "br":
+    # Optional dependency: pip install brotli-asgi. Falls back to gzip for
+    # clients that do not accept br.
+    from brotli_asgi import BrotliMiddleware
+
+    app.add_middleware(BrotliMiddleware, minimum_size=settings.compression_minimum_size)
+elif settings.response_compression == "gzip":
+    app.add_middleware(GZipMiddleware, minimum_size=settings.compression_minimum_size)
+if settings.admission_control_enabled:
+    # Added last so it is outermost: shed requests cost no session or
+    # compression work.
+    app.add_middleware(AdmissionMiddleware, controller=admission_controller)
+app.include_router(scim_router)
+
+
+def _client_ip(request: Request) -> str:
+    if settings.trust_forwarded_for:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
+_s3_client = None
+_bucket_ready = False
+_post_signer: PostPolicySigner | None = None
+
+
+def _get_s3_client():
+    global _s3_client
+    if _s3_client is None:
+        if not settings.minio_endpoint or not settings.minio_access_key or not settings.minio_secret_key:
+            return None
+        # boto3 is slow to import and its clients are expensive to build but
+        # thread-safe; load it on first storage use and keep one client.
+        import boto3
+
+        _s3_client = boto3.client(
+            "s3",
+            endpoint_url=settings.minio_endpoint,
+            aws_access_key_id=settings.minio_access_key,
+            aws_secret_access_key=settings.minio_secret_key,
+            region_name="us-east-1",
+        )
+    return _s3_client
 
 
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/token")
+def _close_s3_client() -> None:
+    global _s3_client, _bucket_ready
+    if _s3_client is not None:
+        _s3_client.close()
+        _s3_client = None
+        _bucket_ready = False
 
 
-def _get_s3_client(endpoint_override: str | None = None):
-    endpoint = endpoint_override or settings.minio_endpoint
-    if not endpoint or not settings.minio_access_key or not settings.minio_secret_key:
-        return None
-    return boto3.client(
-        "s3",
-        endpoint_url=endpoint,
-        aws_access_key_id=settings.minio_access_key,
-        aws_secret_access_key=settings.minio_secret_key,
-        region_name="us-east-1",
-    )
+def _get_post_signer() -> PostPolicySigner | None:
+    global _post_signer
+    if _post_signer is None and settings.minio_access_key and settings.minio_secret_key:
+        _post_signer = PostPolicySigner(settings.minio_access_key, settings.minio_secret_key)
+    return _post_signer
 
 
 def _ensure_bucket(client) -> None:
+    global _bucket_ready
+    if _bucket_ready:
+        return
     bucket = settings.minio_bucket
     try:
         client.head_bucket(Bucket=bucket)
@@ -76,7 +190,7 @@ def _ensure_bucket(client) -> None:
                 "Effect": "Allow",
                 "Principal": "*",
                 "Action": ["s3:GetObject"],
-                "Resource": [f"arn:aws:s3:::{bucket}/*"],
+                "Resource": [f"arn:aws:s3:::{bucket}/avatars/*"],
             }
         ],
     }
@@ -84,53 +198,131 @@ def _ensure_bucket(client) -> None:
         client.put_bucket_policy(Bucket=bucket, Policy=json.dumps(policy))
     except ClientError:
         pass
+    # Raw uploads live under a per-day prefix and are removed once processed;
+    # abandoned ones expire with the rest of their day.
+    lifecycle = {
+        "Rules": [
+            {
+                "ID": "expire-avatar-uploads",
+                "Status": "Enabled",
+                "Filter": {"Prefix": f"{AVATAR_UPLOAD_PREFIX}/"},
+                "Expiration": {"Days": settings.avatar_upload_retention_days},
+            }
+        ]
+    }
+    try:
+        client.put_bucket_lifecycle_configuration(Bucket=bucket, LifecycleConfiguration=lifecycle)
+    except ClientError:
+        pass
+    _bucket_ready = True
 
 
-async def _store_social_avatar(
-    user_id: str,
-    provider: str,
-    avatar_url: str,
-) -> dict | None:
+async def _store_social_avatar(provider: str, avatar_url: str) -> dict | None:
     if not avatar_url:
         return None
     client = _get_s3_client()
     if not client:
         return None
+    if not (settings.minio_public_base_url or "").rstrip("/"):
+        return None
     await run_in_threadpool(_ensure_bucket, client)
-    async with httpx.AsyncClient(follow_redirects=True, timeout=10) as http:
-        resp = await http.get(avatar_url)
-        resp.raise_for_status()
-        content_type = resp.headers.get("content-type", "image/jpeg").split(";")[0].strip()
-        ext = {
-            "image/png": "png",
-            "image/jpeg": "jpg",
-            "image/jpg": "jpg",
-            "image/gif": "gif",
-            "image/webp": "webp",
-        }.get(content_type, "jpg")
-        object_key = f"avatars/{user_id}/{uuid4().hex}.{ext}"
-        await run_in_threadpool(
-            client.put_object,
-            Bucket=settings.minio_bucket,
-            Key=object_key,
-            Body=resp.content,
-            ContentType=content_type,
-        )
-    public_endpoint = (settings.minio_public_base_url or "").rstrip("/")
-    if not public_endpoint:
+    import httpx
+
+    data = bytearray()
+    try:
+        async with httpx.AsyncClient(follow_redirects=True, timeout=10) as http:
+            async with http.stream("GET", avatar_url) as resp:
+                resp.raise_for_status()
+                async for chunk in resp.aiter_bytes():
+                    data += chunk
+                    if len(data) > settings.avatar_max_bytes:
+                        raise AvatarError("Image is too large")
+        return await store_avatar(client, bytes(data), provider)
+    except (AvatarError, httpx.HTTPError):
+        # A broken provider picture should not fail the sign-in.
         return None
-    return {
-        "avatar_url": f"{public_endpoint}/{settings.minio_bucket}/{object_key}",
-        "avatar_object_key": object_key,
-        "avatar_source": provider,
-    }
 
 
-@app.on_event("startup")
+def _avatar_upload_prefix(user_id: str) -> str:
+    return f"{AVATAR_UPLOAD_PREFIX}/{datetime.now(timezone.utc):%Y%m%d}/{user_id}/"
+
+
+async def _pin_reads_to_primary(session: AsyncSession, token: str, response: Response) -> None:
+    # Serve this caller's reads from the primary, or from a replica that has
+    # replayed this write, until replicas have caught up.
+    if not replicas:
+        return
+    pin_to_primary(token)
+    lsn = await write_lsn(session)
+    response.headers[READ_AFTER_HEADER] = lsn
+    response.set_cookie(
+        READ_AFTER_COOKIE,
+        lsn,
+        max_age=math.ceil(settings.db_read_your_writes_seconds),
+        httponly=True,
+        samesite="lax",
+    )
+
+
+_background_tasks: set[asyncio.Task] = set()
+
+
 async def startup() -> None:
+    log_pool_sizing()
     if settings.auto_create_tables:
         async with engine.begin() as conn:
             await conn.run_sync(Base.metadata.create_all)
+            # create_all does not add columns to existing tables.
+            await conn.execute(
+                text("ALTER TABLE users ADD COLUMN IF NOT EXISTS is_admin boolean NOT NULL DEFAULT false")
+            )
+            await conn.execute(
+                text("ALTER TABLE users ADD COLUMN IF NOT EXISTS updated_at timestamptz NOT NULL DEFAULT now()")
+            )
+            await conn.execute(text("CREATE INDEX IF NOT EXISTS ix_users_updated_at ON users (updated_at)"))
+            await conn.execute(text("CREATE INDEX IF NOT EXISTS ix_users_email_lower ON users (lower(email))"))
+            await conn.execute(
+                text("ALTER TABLE outbox_events ADD COLUMN IF NOT EXISTS claimed_until timestamptz")
+            )
+        async with SessionLocal() as session:
+            await backfill_identities(session)
+    if settings.login_bloom_enabled:
+        _background_tasks.add(asyncio.create_task(known_emails.run_refresher()))
+    if replicas:
+        _background_tasks.add(asyncio.create_task(run_replica_monitor()))
+    if outbox_relay.sink and settings.outbox_relay:
+        _background_tasks.add(asyncio.create_task(outbox_relay.run()))
+    if settings.audit_enabled:
+        _background_tasks.add(asyncio.create_task(audit_writer.run()))
+    if settings.token_revocation_enabled:
+        _background_tasks.add(asyncio.create_task(revocation_list.run_refresher()))
+
+
+async def shutdown() -> None:
+    # By now uvicorn has closed the listening socket and waited for in-flight
+    # requests and their background tasks (bounded by its graceful shutdown
+    # timeout, see gunicorn_conf.py). What is left shares one budget.
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.shutdown_flush_seconds
+    for task in _background_tasks:
+        task.cancel()
+    await asyncio.gather(*_background_tasks, return_exceptions=True)
+    _background_tasks.clear()
+
+    # Flush buffered writes while the pools and sinks are still open.
+    try:
+        await asyncio.wait_for(audit_writer.flush(), max(0.0, deadline - loop.time()))
+    except asyncio.TimeoutError:
+        logger.warning("Audit flush timed out during shutdown; %d events were not written", audit_writer.pending)
+    if outbox_relay.sink and settings.outbox_relay:
+        await outbox_relay.drain(max(0.0, deadline - loop.time()))
+    if hasattr(outbox_relay.sink, "aclose"):
+        await outbox_relay.sink.aclose()
+
+    _close_s3_client()
+    close_avatar_executor()
+    close_hash_executor()
+    await dispose_engines()
 
 
 @app.get("/health")
@@ -138,6 +330,16 @@ async def health() -> dict:
     return {"status": "ok"}
 
 
+@app.get("/metrics/db")
+async def db_metrics() -> dict:
+    return {"pools": pool_stats()}
+
+
+@app.get("/metrics/admission")
+async def admission_metrics() -> dict:
+    return admission_controller.stats()
+
+
 @app.get("/.well-known/jwks.json")
 async def jwks() -> dict:
     return get_jwks()
@@ -173,60 +375,215 @@ async def register_user(payload: UserCreate, session: AsyncSession = Depends(get
     user = User(
         email=payload.email,
         full_name=payload.full_name,
-        hashed_password=hash_password(payload.password),
+        hashed_password=await hash_password_async(payload.password),
+        identity_data={},
+        is_active=True,
     )
     session.add(user)
+    record_user_event(session, USER_CREATED, user)
     await session.commit()
+    outbox_relay.notify()
     await session.refresh(user)
+    known_emails.add(user.email)
     return user
 
 
-@app.post("/auth/token", response_model=Token)
+def _basic_credentials(request: Request) -> tuple[str, str] | None:
+    scheme, _, encoded = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "basic" or not encoded:
+        return None
+    try:
+        client_id, _, client_secret = base64.b64decode(encoded).decode("utf-8").partition(":")
+    except ValueError:
+        return None
+    return unquote(client_id), unquote(client_secret)
+
+
+async def _authenticated_client(
+    request: Request,
+    session: AsyncSession,
+    client_id: str | None,
+    client_secret: str | None,
+) -> OAuthClient:
+    basic = _basic_credentials(request)
+    if basic:
+        client_id, client_secret = basic
+    client = None
+    if client_id and client_secret:
+        client = await authenticate_client(session, client_id, client_secret)
+    if not client:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid client credentials",
+            headers={"WWW-Authenticate": "Basic"},
+        )
+    return client
+
+
+async def _client_credentials_token(
+    request: Request,
+    session: AsyncSession,
+    client_id: str | None,
+    client_secret: str | None,
+    scope: str,
+) -> Token:
+    client = await _authenticated_client(request, session, client_id, client_secret)
+    allowed = client_scopes(client)
+    requested = scope.split() or allowed
+    if not set(requested) <= set(allowed):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Requested scope not allowed")
+    token, expires_in = issue_client_token(client, requested)
+    return Token(access_token=token, expires_in=expires_in, scope=" ".join(sorted(requested)))
+
+
+@app.post("/auth/token", response_model=Token, response_model_exclude_none=True)
 async def login_for_access_token(
-    form_data: OAuth2PasswordRequestForm = Depends(),
-    session: AsyncSession = Depends(get_session),
+    request: Request,
+    background_tasks: BackgroundTasks,
+    grant_type: str = Form("password"),
+    username: str | None = Form(None),
+    password: str | None = Form(None),
+    scope: str = Form(""),
+    client_id: str | None = Form(None),
+    client_secret: str | None = Form(None),
+    session: AsyncSession = Depends(get_read_session),
 ) -> Token:
-    user = await authenticate_user(session, form_data.username, form_data.password)
+    if grant_type == "client_credentials":
+        return await _client_credentials_token(request, session, client_id, client_secret, scope)
+    if grant_type != "password":
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Unsupported grant type")
+    if not username or password is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="username and password are required")
+
+    client_ip = _client_ip(request)
+    retry_after = await login_limiter.check(client_ip, username)
+    if retry_after:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many login attempts",
+            headers={"Retry-After": str(math.ceil(retry_after))},
+        )
+
+    user = await authenticate_user(session, username, password)
     if not user:
+        await login_limiter.failed(client_ip, username)
+        await audit_writer.record(provider="password", success=False, email=username, ip=client_ip)
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
+    await login_limiter.succeeded(client_ip, username)
+    await audit_writer.record(provider="password", success=True, email=user.email, ip=client_ip, user_id=user.id)
+    if password_needs_rehash(user.hashed_password):
+        background_tasks.add_task(rehash_password, user.id, password, user.hashed_password)
 
     token = create_access_token(subject=str(user.id), email=user.email)
     return Token(access_token=token)
 
 
+@app.post("/auth/introspect")
+async def introspect(
+    request: Request,
+    token: str = Form(...),
+    client_id: str | None = Form(None),
+    client_secret: str | None = Form(None),
+    session: AsyncSession = Depends(get_read_session),
+) -> dict:
+    await _authenticated_client(request, session, client_id, client_secret)
+    return introspect_token(token)
+
+
+@app.post("/auth/introspect/batch")
+async def introspect_batch(
+    request: Request,
+    payload: IntrospectionBatch,
+    session: AsyncSession = Depends(get_read_session),
+) -> dict:
+    await _authenticated_client(request, session, None, None)
+    if len(payload.tokens) > settings.introspection_batch_max:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {settings.introspection_batch_max} tokens per request",
+        )
+    # Duplicates are common when a gateway flushes a window of requests.
+    results = {token: introspect_token(token) for token in dict.fromkeys(payload.tokens)}
+    return {"results": [results[token] for token in payload.tokens]}
+
+
+@app.post("/auth/revoke")
+async def revoke_token(token: str = Form(...)) -> Response:
+    # RFC 7009: holding the token is enough to revoke it, and unknown or
+    # invalid tokens are not an error.
+    claims = safe_decode_token(token)
+    if claims:
+        await revocation_list.revoke(claims)
+        forget_client_token(claims)
+    return Response(status_code=status.HTTP_200_OK)
+
+
+@app.post("/admin/clients", response_model=ClientCredentials)
+async def create_client(
+    payload: ClientCreate,
+    admin: dict = Depends(require_admin),
+    session: AsyncSession = Depends(get_session),
+) -> ClientCredentials:
+    client, secret = await register_client(session, payload.name, payload.scopes)
+    return ClientCredentials(
+        client_id=client.client_id,
+        client_secret=secret,
+        name=client.name,
+        scopes=client_scopes(client),
+    )
+
+
 @app.get("/auth/me", response_model=UserPublic)
 async def get_me(
+    fields: str | None = None,
     token: str = Depends(oauth2_scheme),
-    session: AsyncSession = Depends(get_session),
+    session: AsyncSession = Depends(get_read_session),
 ) -> UserPublic:
     payload = safe_decode_token(token)
-    if not payload or not payload.get("sub"):
+    if not payload or not payload.get("sub") or payload.get("client_id"):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
 
-    result = await session.execute(select(User).where(User.id == payload["sub"]))
-    user = result.scalar_one_or_none()
+    if fields is not None:
+        selected = parse_fields(fields)
+        statement = user_projection(selected).add_columns(User.is_active.label("_is_active"))
+        row = await one_or_primary(session, statement.where(User.id == payload["sub"]))
+        if not row:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+        if not row._is_active:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+        return JSONResponse(jsonable_encoder(to_sparse(row, selected)))
+
+    user = await scalar_one_or_primary(session, select(User).where(User.id == payload["sub"]))
     if not user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+    if not user.is_active:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
     return user
 
 
 @app.get("/auth/users", response_model=list[UserPublic])
 async def find_users(
     email: str,
+    fields: str | None = None,
     token: str = Depends(oauth2_scheme),
-    session: AsyncSession = Depends(get_session),
+    session: AsyncSession = Depends(get_read_session),
 ) -> list[UserPublic]:
     payload = safe_decode_token(token)
     if not payload or not payload.get("sub"):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
 
+    if fields is not None:
+        selected = parse_fields(fields)
+        result = await session.execute(user_projection(selected).where(User.email.ilike(email)))
+        return JSONResponse(jsonable_encoder([to_sparse(row, selected) for row in result]))
+
     result = await session.execute(select(User).where(User.email.ilike(email)))
     users = result.scalars().all()
     return users
 
 
 @app.get("/auth/public/users", response_model=list[UserPublicProfile])
-async def get_public_users(ids: str, session: AsyncSession = Depends(get_session)) -> list[UserPublicProfile]:
+async def get_public_users(ids: str, session: AsyncSession = Depends(get_read_session)) -> list[UserPublicProfile]:
     id_list = [item.strip() for item in ids.split(",") if item.strip()]
     if not id_list:
         return []
@@ -249,6 +606,7 @@ async def get_public_users(ids: str, session: AsyncSession = Depends(get_session
 @app.put("/auth/me", response_model=UserPublic)
 async def update_me(
     payload: UserProfileUpdate,
+    response: Response,
     token: str = Depends(oauth2_scheme),
     session: AsyncSession = Depends(get_session),
 ) -> UserPublic:
@@ -256,7 +614,7 @@ async def update_me(
     full_name = profile.pop("full_name", None)
 
     payload_data = safe_decode_token(token)
-    if not payload_data or not payload_data.get("sub"):
+    if not payload_data or not payload_data.get("sub") or payload_data.get("client_id"):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
 
     result = await session.execute(select(User).where(User.id == payload_data["sub"]))
@@ -271,49 +629,124 @@ async def update_me(
     identity.update(profile)
     user.identity_data = identity
 
+    record_user_event(session, USER_UPDATED, user)
     await session.commit()
+    outbox_relay.notify()
     await session.refresh(user)
+    await _pin_reads_to_primary(session, token, response)
     return user
 
 
 @app.post("/auth/avatar/upload-url")
 async def create_avatar_upload_url(token: str = Depends(oauth2_scheme)) -> JSONResponse:
     payload = safe_decode_token(token)
-    if not payload or not payload.get("sub"):
+    if not payload or not payload.get("sub") or payload.get("client_id"):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
 
-    internal_client = _get_s3_client()
-    if not internal_client:
+    client = _get_s3_client()
+    signer = _get_post_signer()
+    if not client or not signer:
         raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="MinIO not configured")
 
-    _ensure_bucket(internal_client)
-    object_key = f"avatars/{payload['sub']}/{uuid4().hex}.png"
+    await run_in_threadpool(_ensure_bucket, client)
+    object_key = _avatar_upload_prefix(payload["sub"]) + uuid4().hex
+    expires_in = settings.avatar_upload_expires_seconds
+    fields = signer.presigned_post(
+        settings.minio_bucket,
+        object_key,
+        content_type="image/",
+        max_bytes=settings.avatar_max_bytes,
+        expires_in=expires_in,
+    )
+    # POST policies do not sign the host, so the public endpoint needs no
+    # separate client.
     public_endpoint = settings.minio_public_base_url.rstrip("/")
-    signing_client = None
-    if public_endpoint.startswith("http://") or public_endpoint.startswith("https://"):
-        signing_client = _get_s3_client(endpoint_override=public_endpoint)
-    if not signing_client:
-        signing_client = internal_client
+    return JSONResponse(
+        {
+            "upload_url": f"{public_endpoint}/{settings.minio_bucket}",
+            "fields": fields,
+            "object_key": object_key,
+            "expires_in": expires_in,
+        }
+    )
+
+
+@app.post("/auth/avatar/complete", response_model=UserPublic)
+async def complete_avatar_upload(
+    payload: AvatarUploadComplete,
+    response: Response,
+    token: str = Depends(oauth2_scheme),
+    session: AsyncSession = Depends(get_session),
+) -> UserPublic:
+    claims = safe_decode_token(token)
+    if not claims or not claims.get("sub") or claims.get("client_id"):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+    client = _get_s3_client()
+    if not client:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="MinIO not configured")
+    upload_key = payload.object_key
+    prefix, _, rest = upload_key.partition("/")
+    day, _, rest = rest.partition("/")
+    owner, _, name = rest.partition("/")
+    if prefix != AVATAR_UPLOAD_PREFIX or not day.isdigit() or owner != claims["sub"] or not name or "/" in name:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Unknown upload")
+
     try:
-        upload_url = signing_client.generate_presigned_url(
-            "put_object",
-            Params={
-                "Bucket": settings.minio_bucket,
-                "Key": object_key,
-                "ContentType": "image/png",
-            },
-            ExpiresIn=300,
-        )
+        obj = await run_in_threadpool(client.get_object, Bucket=settings.minio_bucket, Key=upload_key)
+        data = await run_in_threadpool(obj["Body"].read)
     except ClientError as exc:
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(exc)) from exc
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload not found") from exc
+    try:
+        stored = await store_avatar(client, data, "upload")
+    except AvatarError as exc:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(exc)) from exc
+    finally:
+        await run_in_threadpool(client.delete_object, Bucket=settings.minio_bucket, Key=upload_key)
+
+    user = (await session.execute(select(User).where(User.id == claims["sub"]))).scalar_one_or_none()
+    if not user:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+    user.identity_data = {**(user.identity_data or {}), **stored}
+    record_user_event(session, USER_UPDATED, user)
+    await session.commit()
+    outbox_relay.notify()
+    await session.refresh(user)
+    await _pin_reads_to_primary(session, token, response)
+    return user
 
-    public_url = f"{public_endpoint}/{settings.minio_bucket}/{object_key}"
-    return JSONResponse({"upload_url": upload_url, "public_url": public_url, "object_key": object_key})
+
+_BULK_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+@app.get("/admin/users/export")
+async def export_users_endpoint(format: str = "ndjson", admin: dict = Depends(require_admin)) -> StreamingResponse:
+    if format not in _BULK_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail="format must be ndjson or csv")
+    return StreamingResponse(
+        export_users(format),
+        media_type=_BULK_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="users.{format}"'},
+    )
+
+
+@app.post("/admin/users/import")
+async def import_users_endpoint(
+    request: Request,
+    format: str = "ndjson",
+    admin: dict = Depends(require_admin),
+) -> dict:
+    if format not in _BULK_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail="format must be ndjson or csv")
+    result = await import_users(request.stream(), format)
+    # Imported rows keep their original created_at, which the incremental
+    # refresh would miss.
+    known_emails.invalidate()
+    return result
 
 
 @app.get("/auth/{provider}/login")
 async def social_login(provider: str, request: Request):
-    client = oauth.create_client(provider)
+    client = get_oauth().create_client(provider)
     if client is None:
         raise HTTPException(status_code=400, detail="Provider not enabled")
 
@@ -334,51 +767,51 @@ async def social_callback(
     if not profile.get("email"):
         raise HTTPException(status_code=400, detail="Provider did not return an email")
 
-    result = await session.execute(
-        select(User).where(
-            (User.provider == provider) & (User.provider_account_id == profile["provider_account_id"])
-        )
-    )
-    user = result.scalar_one_or_none()
+    if not profile.get("provider_account_id"):
+        raise HTTPException(status_code=400, detail="Provider did not return an account id")
 
-    if not user:
-        result = await session.execute(select(User).where(User.email == profile["email"]))
-        user = result.scalar_one_or_none()
-
-    if not user:
-        user = User(
-            email=profile["email"],
-            full_name=profile.get("full_name"),
-            provider=provider,
-            provider_account_id=profile.get("provider_account_id"),
-            identity_data=profile.get("raw", {}),
+    user, created = await resolve_social_user(
+        session, provider, profile["provider_account_id"], profile["email"], profile.get("full_name")
+    )
+    if not user.is_active:
+        email, user_id = user.email, user.id
+        await session.rollback()
+        await audit_writer.record(
+            provider=provider, success=False, email=email, ip=_client_ip(request), user_id=user_id
         )
-        session.add(user)
-    else:
-        user.provider = provider
-        user.provider_account_id = profile.get("provider_account_id")
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="User is inactive")
+    # Assigning equal values leaves the attributes clean, so an unchanged
+    # user row is not rewritten.
+    user.provider = provider
+    user.provider_account_id = profile["provider_account_id"]
+
+    # The raw payload lives in provider_profiles to keep the users row small.
+    await store_provider_profile(session, user.id, provider, profile.get("raw") or {})
+    changed = created or session.is_modified(user)
+    if changed:
+        record_user_event(session, USER_CREATED if created else USER_UPDATED, user)
+    # Commit before the avatar download so no transaction (and no row lock
+    # from the upsert) is held across it.
+    await session.commit()
 
-    identity = dict(user.identity_data or {})
-    existing_avatar_url = identity.get("avatar_url")
-    existing_avatar_key = identity.get("avatar_object_key")
-    raw_profile = dict(profile.get("raw", {}) or {})
-    raw_profile.pop("picture", None)
-    raw_profile.pop("avatar_url", None)
-    identity.update(raw_profile)
-    if existing_avatar_key:
-        identity["avatar_object_key"] = existing_avatar_key
-    if existing_avatar_url:
-        identity["avatar_url"] = existing_avatar_url
-    if not existing_avatar_url and not existing_avatar_key and profile.get("avatar_url"):
-        if not user.id:
-            user.id = uuid4()
-        stored = await _store_social_avatar(str(user.id), provider, profile["avatar_url"])
+    identity = user.identity_data or {}
+    if not identity.get("avatar_url") and not identity.get("avatar_object_key") and profile.get("avatar_url"):
+        stored = await _store_social_avatar(provider, profile["avatar_url"])
         if stored:
-            identity.update(stored)
-    user.identity_data = identity
-
-    await session.commit()
-    await session.refresh(user)
+            user = await session.get(User, user.id, with_for_update=True, populate_existing=True)
+            identity = user.identity_data or {}
+            # Another login or a profile update may have set one meanwhile.
+            if not identity.get("avatar_url") and not identity.get("avatar_object_key"):
+                user.identity_data = {**identity, **stored}
+                record_user_event(session, USER_UPDATED, user)
+                changed = True
+            await session.commit()
+    if changed:
+        outbox_relay.notify()
+    known_emails.add(user.email)
+    await audit_writer.record(
+        provider=provider, success=True, email=user.email, ip=_client_ip(request), user_id=user.id
+    )
 
     token = create_access_token(subject=str(user.id), email=user.email)
     if settings.frontend_redirect_url:
@@ -1,14 +1,23 @@
 from __future__ import annotations
 
-from typing import Any
+from typing import TYPE_CHECKING, Any
 
-from authlib.integrations.starlette_client import OAuth
 from fastapi import HTTPException
 
 from config import settings
 
+if TYPE_CHECKING:
+    from authlib.integrations.starlette_client import OAuth
+
+
+_oauth: OAuth | None = None
+
 
 def build_oauth() -> OAuth:
+    # authlib (and the httpx client under it) is slow to import; it is only
+    # needed once somebody signs in with a provider.
+    from authlib.integrations.starlette_client import OAuth
+
     oauth = OAuth()
 
     if settings.social_enabled("google"):
@@ -36,11 +45,15 @@ def build_oauth() -> OAuth:
     return oauth
 
 
-oauth = build_oauth()
+def get_oauth() -> OAuth:
+    global _oauth
+    if _oauth is None:
+        _oauth = build_oauth()
+    return _oauth
 
 
 async def fetch_social_profile(provider: str, request) -> dict[str, Any]:
-    client = oauth.create_client(provider)
+    client = get_oauth().create_client(provider)
     if client is None:
         raise HTTPException(status_code=400, detail="Provider not enabled")
     token = await client.authorize_access_token(request)
@@ -0,0 +1,162 @@
+"""Declarative service graph for bringing up the PIdP stack.
+
+Each node runs once all of its dependencies are ready, so independent nodes
+(image builds, Postgres, MinIO) start in parallel. Containers are started
+through ``docker_utils.ensure_container`` and reused when their config is
+unchanged. Every step is timed and a summary is printed at the end.
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Awaitable, Callable
+
+import docker_utils
+import readiness
+
+
+class _Skipped(RuntimeError):
+    pass
+
+
+class Node:
+    def __init__(self, name: str, depends_on: tuple[str, ...] = ()):
+        self.name = name
+        self.depends_on = tuple(depends_on)
+
+    async def run(self, graph: ServiceGraph) -> None:
+        raise NotImplementedError
+
+
+class Build(Node):
+    """Builds a Docker image; relies on the daemon's layer cache for speed."""
+
+    def __init__(self, name: str, path: str, tag: str, depends_on: tuple[str, ...] = ()):
+        super().__init__(name, depends_on)
+        self.path = path
+        self.tag = tag
+
+    async def run(self, graph: ServiceGraph) -> None:
+        with graph.step(f"build {self.tag}"):
+            await asyncio.to_thread(docker_utils.get_docker_client().images.build, path=self.path, tag=self.tag, rm=True)
+
+
+class Service(Node):
+    """A container plus the probe that gates its dependents."""
+
+    def __init__(
+        self,
+        name: str,
+        config: dict,
+        depends_on: tuple[str, ...] = (),
+        ready: Callable[[readiness.Prober], Callable[[], Awaitable[None]]] | None = None,
+        ready_timeout: float = 120.0,
+    ):
+        super().__init__(name, depends_on)
+        self.config = config
+        self.ready = ready
+        self.ready_timeout = ready_timeout
+
+    async def run(self, graph: ServiceGraph) -> None:
+        with graph.step(f"start {self.name}") as step:
+            _, action = await asyncio.to_thread(docker_utils.ensure_container, self.config)
+            step["note"] = action
+        if self.ready is not None:
+            with graph.step(f"ready {self.name}"):
+                await readiness.wait_for({self.name: self.ready(graph.prober)}, deadline=self.ready_timeout)
+
+
+class _Step:
+    def __init__(self, graph: ServiceGraph, label: str):
+        self.graph = graph
+        self.record = {"step": label, "seconds": 0.0, "note": ""}
+
+    def __enter__(self) -> dict:
+        self.started = time.monotonic()
+        return self.record
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.record["seconds"] = time.monotonic() - self.started
+        if exc_type is not None:
+            self.record["note"] = "failed"
+        self.graph.timings.append(self.record)
+        print(f"{self.record['step']}: {self.record['seconds']:.1f}s {self.record['note']}".rstrip())
+
+
+class ServiceGraph:
+    def __init__(self, network: str):
+        self.network = network
+        self.nodes: dict[str, Node] = {}
+        self.timings: list[dict] = []
+        self.prober = readiness.Prober(docker_utils.get_docker_client(), network)
+
+    def add(self, node: Node) -> Node:
+        self.nodes[node.name] = node
+        return node
+
+    def step(self, label: str) -> _Step:
+        return _Step(self, label)
+
+    def _check(self) -> None:
+        visiting: set[str] = set()
+        done: set[str] = set()
+
+        def visit(name: str) -> None:
+            if name in done:
+                return
+            if name not in self.nodes:
+                raise ValueError(f"Unknown dependency: {name}")
+            if name in visiting:
+                raise ValueError(f"Dependency cycle through {name}")
+            visiting.add(name)
+            for dependency in self.nodes[name].depends_on:
+                visit(dependency)
+            visiting.discard(name)
+            done.add(name)
+
+        for name in self.nodes:
+            visit(name)
+
+    async def _up(self) -> None:
+        self._check()
+        finished = {name: asyncio.Event() for name in self.nodes}
+        failed: set[str] = set()
+
+        async def run(node: Node) -> None:
+            try:
+                for dependency in node.depends_on:
+                    await finished[dependency].wait()
+                blocked = [name for name in node.depends_on if name in failed]
+                if blocked:
+                    raise _Skipped(f"{node.name} skipped: {', '.join(blocked)} failed")
+                await node.run(self)
+            except BaseException:
+                failed.add(node.name)
+                raise
+            finally:
+                finished[node.name].set()
+
+        results = await asyncio.gather(*(run(node) for node in self.nodes.values()), return_exceptions=True)
+        errors = [result for result in results if isinstance(result, BaseException)]
+        # Raise a root cause rather than a node skipped because of it.
+        errors.sort(key=lambda error: isinstance(error, _Skipped))
+        if errors:
+            raise errors[0]
+
+    def up(self) -> list[dict]:
+        """Bring the graph up; returns the per-step timings."""
+        started = time.monotonic()
+        docker_utils.ensure_network(self.network)
+        try:
+            asyncio.run(self._up())
+        finally:
+            self.prober.close()
+            self.report(time.monotonic() - started)
+        return self.timings
+
+    def report(self, total: float) -> None:
+        width = max((len(record["step"]) for record in self.timings), default=4)
+        print(f"{'step'.ljust(width)}  seconds")
+        for record in self.timings:
+            print(f"{record['step'].ljust(width)}  {record['seconds']:7.1f}  {record['note']}".rstrip())
+        print(f"{'total'.ljust(width)}  {total:7.1f}")
@@ -0,0 +1,233 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import uuid
+from datetime import timedelta
+
+from sqlalchemy import delete, func, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import settings
+from db import SessionLocal, lift_statement_timeout, raw_connection
+from models import OutboxEvent, User
+
+
+logger = logging.getLogger(__name__)
+
+USER_CREATED = "user.created"
+USER_UPDATED = "user.updated"
+USER_DELETED = "user.deleted"
+
+
+def user_payload(user_id, email: str, full_name: str | None, is_active: bool, identity: dict | None) -> dict:
+    identity = identity or {}
+    return {
+        "id": str(user_id),
+        "email": email,
+        "full_name": full_name,
+        "display_name": identity.get("display_name"),
+        "avatar_url": identity.get("avatar_url"),
+        "is_active": is_active,
+    }
+
+
+def record_event(session: AsyncSession, event_type: str, user_id, payload: dict) -> None:
+    """Add a change event to ``session`` so it commits with the change itself."""
+    if not settings.outbox_sink:
+        return
+    session.add(OutboxEvent(aggregate_id=user_id, event_type=event_type, payload=payload))
+
+
+def record_user_event(session: AsyncSession, event_type: str, user: User) -> None:
+    if user.id is None:
+        # Assign the primary key now so the event can reference it.
+        user.id = uuid.uuid4()
+    if user.is_active is None:
+        # Column defaults are only applied at flush, after the payload is built.
+        user.is_active = True
+    payload = user_payload(user.id, user.email, user.full_name, user.is_active, user.identity_data)
+    record_event(session, event_type, user.id, payload)
+
+
+class MemorySink:
+    """Keeps published events in a list; a stand-in for tests and local runs."""
+
+    def __init__(self):
+        self.events: list[dict] = []
+
+    async def publish(self, events: list[dict]) -> None:
+        self.events.extend(events)
+
+
+class FileSink:
+    def __init__(self, path: str):
+        self.path = path
+
+    def _write(self, data: str) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(data)
+
+    async def publish(self, events: list[dict]) -> None:
+        data = "".join(json.dumps(event) + "\n" for event in events)
+        await asyncio.to_thread(self._write, data)
+
+
+class WebhookSink:
+    """POSTs each batch as ``{"events": [...]}``.
+
+    If ``OUTBOX_WEBHOOK_SECRET`` is set, the body is signed with HMAC-SHA256
+    and the signature is sent in ``X-PIdP-Signature``.
+    """
+
+    def __init__(self, url: str):
+        import httpx
+
+        self.url = url
+        self._client = httpx.AsyncClient(timeout=10)
+
+    async def publish(self, events: list[dict]) -> None:
+        body = json.dumps({"events": events}).encode("utf-8")
+        headers = {"Content-Type": "application/json"}
+        if settings.outbox_webhook_secret:
+            signature = hmac.new(settings.outbox_webhook_secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+            headers["X-PIdP-Signature"] = f"sha256={signature}"
+        response = await self._client.post(self.url, content=body, headers=headers)
+        response.raise_for_status()
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
+
+
+def build_sink(spec: str):
+    if not spec:
+        return None
+    if spec == "memory":
+        return MemorySink()
+    if spec.startswith("file:"):
+        return FileSink(spec[len("file:"):])
+    if spec.startswith(("http://", "https://")):
+        return WebhookSink(spec)
+    raise ValueError(f"Unsupported OUTBOX_SINK {spec!r}")
+
+
+class OutboxRelay:
+    """Publishes committed outbox rows in batches and deletes them.
+
+    A batch is claimed by setting a lease (``claimed_until``) in a short
+    transaction, rows locked by another relay are skipped, and the claim is
+    committed before publishing, so no lock or connection is held during a
+    webhook call. Published rows are then deleted; a failed publish releases
+    the claim. Delivery is at least once: a relay that dies mid-batch, or a
+    failed delete, leaves the rows to be claimed again when the lease ends, so
+    consumers should dedupe on the event ``id``.
+
+    Ordering is only kept with a single relay. With several, and whenever a
+    lease expires, a later event for a user can be published before an
+    earlier one; the payload is the full user state, so consumers should
+    keep the event with the highest ``id`` per ``aggregate_id``.
+    """
+
+    def __init__(self, sink):
+        self.sink = sink
+        self._wakeup = asyncio.Event()
+
+    def notify(self) -> None:
+        """Wake the relay after a commit that recorded events."""
+        self._wakeup.set()
+
+    async def _claim(self) -> list:
+        claimable = (
+            select(OutboxEvent.id)
+            .where(or_(OutboxEvent.claimed_until.is_(None), OutboxEvent.claimed_until < func.now()))
+            .order_by(OutboxEvent.id)
+            .limit(settings.outbox_batch_size)
+            .with_for_update(skip_locked=True)
+        )
+        claim = (
+            update(OutboxEvent)
+            .where(OutboxEvent.id.in_(claimable.scalar_subquery()))
+            .values(claimed_until=func.now() + timedelta(seconds=settings.outbox_claim_seconds))
+            .returning(
+                OutboxEvent.id, OutboxEvent.event_type, OutboxEvent.aggregate_id, OutboxEvent.created_at, OutboxEvent.payload
+            )
+            .execution_options(synchronize_session=False)
+        )
+        async with SessionLocal() as session:
+            await lift_statement_timeout(await raw_connection(session))
+            rows = (await session.execute(claim)).all()
+            await session.commit()
+        return sorted(rows, key=lambda row: row.id)
+
+    async def _finish(self, statement) -> None:
+        async with SessionLocal() as session:
+            await session.execute(statement.execution_options(synchronize_session=False))
+            await session.commit()
+
+    async def publish_batch(self) -> int:
+        rows = await self._claim()
+        if not rows:
+            return 0
+        ids = [row.id for row in rows]
+        try:
+            await self.sink.publish(
+                [
+                    {
+                        "id": row.id,
+                        "type": row.event_type,
+                        "aggregate_id": str(row.aggregate_id),
+                        "occurred_at": row.created_at.isoformat(),
+                        "data": row.payload,
+                    }
+                    for row in rows
+                ]
+            )
+        except Exception:
+            # Let the next attempt retry this batch rather than wait out the lease.
+            await self._finish(update(OutboxEvent).where(OutboxEvent.id.in_(ids)).values(claimed_until=None))
+            raise
+        await self._finish(delete(OutboxEvent).where(OutboxEvent.id.in_(ids)))
+        return len(rows)
+
+    async def run(self) -> None:
+        while True:
+            try:
+                published = await self.publish_batch()
+            except Exception:
+                logger.exception("Outbox publish failed; retrying")
+                published = 0
+            if published < settings.outbox_batch_size:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=settings.outbox_poll_seconds)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def drain(self, timeout: float) -> int:
+        """Publish what is pending, for up to ``timeout`` seconds, before shutdown.
+
+        Anything left stays in the table for the next relay to pick up.
+        """
+        published = 0
+
+        async def publish_all() -> None:
+            nonlocal published
+            while True:
+                count = await self.publish_batch()
+                published += count
+                if count < settings.outbox_batch_size:
+                    return
+
+        try:
+            await asyncio.wait_for(publish_all(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Outbox drain timed out after publishing %d events", published)
+        except Exception:
+            logger.exception("Outbox drain failed after publishing %d events", published)
+        return published
+
+
+outbox_relay = OutboxRelay(build_sink(settings.outbox_sink))
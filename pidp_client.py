@@ -0,0 +1,206 @@
+"""Token verification for services that accept PIdP access tokens.
+
+This module only depends on ``python-jose`` and ``httpx`` and can be copied
+into or installed alongside any relying party::
+
+    verifier = TokenVerifier("https://idp.example.com", audience="pidp")
+    claims = await verifier.verify(token)
+
+    app.add_middleware(PIdPAuthMiddleware, verifier=verifier, exclude_paths={"/health"})
+
+Verification follows ``security.decode_token``: RS256 signatures checked
+against the published JWKS, plus ``iss`` and ``aud`` when configured. Keys are
+cached for ``jwks_ttl`` seconds and refreshed in the background after that;
+a token signed with an unknown ``kid`` triggers a refetch at most once per
+``min_refresh_interval``. Verified claims are cached until the token
+expires, so repeat requests cost one dict lookup. Revocation is not visible
+locally; use ``/auth/introspect`` where it matters.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+
+import httpx
+from jose import JWTError, jwk, jwt
+
+
+class TokenError(Exception):
+    pass
+
+
+class TokenVerifier:
+    def __init__(
+        self,
+        base_url: str,
+        *,
+        issuer: str | None = None,
+        audience: str | None = None,
+        algorithms: tuple[str, ...] = ("RS256",),
+        jwks_ttl: float = 300,
+        min_refresh_interval: float = 30,
+        cache_size: int = 10_000,
+        leeway: int = 0,
+        http_client: httpx.AsyncClient | None = None,
+    ):
+        self.jwks_url = base_url.rstrip("/") + "/.well-known/jwks.json"
+        self.issuer = issuer
+        self.audience = audience
+        self.algorithms = list(algorithms)
+        self.jwks_ttl = jwks_ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.cache_size = cache_size
+        self.leeway = leeway
+        self._http = http_client
+        self._owns_http = http_client is None
+        self._keys: dict[str, object] = {}
+        self._fetched_at = 0.0
+        self._refresh_task: asyncio.Task | None = None
+        self._claims: OrderedDict[bytes, dict] = OrderedDict()
+
+    async def _fetch_jwks(self) -> None:
+        if self._http is None:
+            self._http = httpx.AsyncClient(timeout=5)
+        response = await self._http.get(self.jwks_url)
+        response.raise_for_status()
+        keys = {}
+        for key in response.json().get("keys", []):
+            if key.get("kid"):
+                keys[key["kid"]] = jwk.construct(key, key.get("alg") or self.algorithms[0])
+        self._keys = keys
+        self._fetched_at = time.monotonic()
+
+    def _refresh(self) -> asyncio.Task:
+        # Single flight: concurrent callers share one in-progress fetch.
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._fetch_jwks())
+            self._refresh_task.add_done_callback(_ignore_result)
+        return self._refresh_task
+
+    async def _key(self, kid: str | None):
+        if not self._keys:
+            await self._refresh()
+        elif time.monotonic() - self._fetched_at > self.jwks_ttl:
+            # Serve the cached keys while a refresh runs in the background.
+            self._refresh()
+        if kid in self._keys:
+            return self._keys[kid]
+        if kid and time.monotonic() - self._fetched_at > self.min_refresh_interval:
+            await self._refresh()
+        if kid not in self._keys:
+            raise TokenError("Unknown signing key")
+        return self._keys[kid]
+
+    def cached(self, token: str) -> dict | None:
+        """Claims for a token verified earlier and not yet expired."""
+        key = hashlib.blake2b(token.encode("utf-8"), digest_size=16).digest()
+        claims = self._claims.get(key)
+        if claims is None:
+            return None
+        if claims.get("exp", float("inf")) + self.leeway <= time.time():
+            del self._claims[key]
+            return None
+        self._claims.move_to_end(key)
+        return claims
+
+    async def verify(self, token: str) -> dict:
+        claims = self.cached(token)
+        if claims is not None:
+            return claims
+        try:
+            header = jwt.get_unverified_header(token)
+        except JWTError as exc:
+            raise TokenError(str(exc)) from exc
+        try:
+            key = await self._key(header.get("kid"))
+        except httpx.HTTPError as exc:
+            raise TokenError(f"Could not fetch JWKS: {exc}") from exc
+        options = {}
+        if self.issuer:
+            options["issuer"] = self.issuer
+        if self.audience:
+            options["audience"] = self.audience
+        try:
+            claims = jwt.decode(
+                token, key, algorithms=self.algorithms, options={"leeway": self.leeway}, **options
+            )
+        except JWTError as exc:
+            raise TokenError(str(exc)) from exc
+        self._claims[hashlib.blake2b(token.encode("utf-8"), digest_size=16).digest()] = claims
+        if len(self._claims) > self.cache_size:
+            self._claims.popitem(last=False)
+        return claims
+
+    async def aclose(self) -> None:
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+        if self._http is not None and self._owns_http:
+            await self._http.aclose()
+
+
+def _ignore_result(task: asyncio.Task) -> None:
+    # A failed background refresh keeps the previous keys; retrieve the
+    # exception so asyncio does not log it as unhandled.
+    if not task.cancelled():
+        task.exception()
+
+
+class PIdPAuthMiddleware:
+    """ASGI middleware that verifies bearer tokens with a ``TokenVerifier``.
+
+    Verified claims are stored as ``request.state.claims`` (``None`` when no
+    valid token was sent). With ``required=True`` requests without a valid
+    token are rejected with 401, except for ``exclude_paths``.
+    """
+
+    def __init__(self, app, verifier: TokenVerifier, *, required: bool = True, exclude_paths=()):
+        self.app = app
+        self.verifier = verifier
+        self.required = required
+        self.exclude_paths = frozenset(exclude_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            return await self.app(scope, receive, send)
+        claims = None
+        token = _bearer_token(scope)
+        if token:
+            try:
+                claims = await self.verifier.verify(token)
+            except TokenError:
+                claims = None
+        scope.setdefault("state", {})["claims"] = claims
+        if claims is None and self.required and scope["path"] not in self.exclude_paths:
+            return await _reject(scope, send)
+        await self.app(scope, receive, send)
+
+
+def _bearer_token(scope) -> str | None:
+    for name, value in scope.get("headers", ()):
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            if scheme.lower() == "bearer" and token:
+                return token.strip()
+    return None
+
+
+async def _reject(scope, send) -> None:
+    if scope["type"] == "websocket":
+        await send({"type": "websocket.close", "code": 1008})
+        return
+    body = json.dumps({"detail": "Invalid token"}).encode("utf-8")
+    await send(
+        {
+            "type": "http.response.start",
+            "status": 401,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode("ascii")),
+                (b"www-authenticate", b"Bearer"),
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
@@ -6,6 +6,15 @@ PIDP_POSTGRES_PASSWORD = "changeme"
 PIDP_POSTGRES_USER = "PIdP"
 PIDP_SECRET_KEY = "changeme"
 
+# True runs a single uvicorn process that reloads on source changes.
+PIDP_DEV_RELOAD = False
+# Number of gunicorn workers; None sizes it from the container's CPUs.
+PIDP_WEB_CONCURRENCY = None
+# Build the pidp image from this directory before starting (uses the layer cache).
+PIDP_BUILD_IMAGE = True
+# Also run a MinIO container named after the host in MINIO_ENDPOINT.
+PIDP_RUN_MINIO = False
+
 PIDP_GOOGLE_CLIENT_ID = "google-client-id"
 PIDP_GOOGLE_CLIENT_SECRET = "google-client-secret"
 PIDP_GOOGLE_REDIRECT_URI = PIDP_BASE_ADDR + "auth/google/callback"
@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+import base64
+import hashlib
+import hmac
+import json
+from datetime import datetime, timedelta, timezone
+
+
+class PostPolicySigner:
+    """Signs S3 browser-upload (POST policy) forms with SigV4, locally.
+
+    Unlike boto3's presigners this needs no client object and makes no network
+    calls. POST policies do not sign the host, so one signer serves both the
+    internal and the public MinIO endpoint. The derived signing key changes
+    once a day and is cached.
+    """
+
+    def __init__(self, access_key: str, secret_key: str, region: str = "us-east-1"):
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self._signing_key: tuple[str, bytes] | None = None
+
+    def _key_for(self, date: str) -> bytes:
+        if self._signing_key is None or self._signing_key[0] != date:
+            key = ("AWS4" + self.secret_key).encode("utf-8")
+            for part in (date, self.region, "s3", "aws4_request"):
+                key = hmac.new(key, part.encode("utf-8"), hashlib.sha256).digest()
+            self._signing_key = (date, key)
+        return self._signing_key[1]
+
+    def presigned_post(
+        self,
+        bucket: str,
+        key: str,
+        *,
+        content_type: str,
+        max_bytes: int,
+        expires_in: int = 300,
+        min_bytes: int = 1,
+    ) -> dict[str, str]:
+        """Return the form fields for uploading exactly ``key`` to ``bucket``.
+
+        ``content_type`` may end in ``/`` to allow any subtype, e.g. ``image/``.
+        """
+        now = datetime.now(timezone.utc)
+        date = now.strftime("%Y%m%d")
+        amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+        credential = f"{self.access_key}/{date}/{self.region}/s3/aws4_request"
+        type_condition = (
+            ["starts-with", "$Content-Type", content_type]
+            if content_type.endswith("/")
+            else {"Content-Type": content_type}
+        )
+        policy = {
+            "expiration": (now + timedelta(seconds=expires_in)).strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+            "conditions": [
+                {"bucket": bucket},
+                {"key": key},
+                type_condition,
+                ["content-length-range", min_bytes, max_bytes],
+                {"x-amz-algorithm": "AWS4-HMAC-SHA256"},
+                {"x-amz-credential": credential},
+                {"x-amz-date": amz_date},
+            ],
+        }
+        encoded = base64.b64encode(json.dumps(policy, separators=(",", ":")).encode("utf-8")).decode("ascii")
+        signature = hmac.new(self._key_for(date), encoded.encode("ascii"), hashlib.sha256).hexdigest()
+        fields = {
+            "key": key,
+            "x-amz-algorithm": "AWS4-HMAC-SHA256",
+            "x-amz-credential": credential,
+            "x-amz-date": amz_date,
+            "policy": encoded,
+            "x-amz-signature": signature,
+        }
+        if not content_type.endswith("/"):
+            fields["Content-Type"] = content_type
+        return fields
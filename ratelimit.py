@@ -0,0 +1,186 @@
+from __future__ import annotations
+
+import time
+from collections import OrderedDict
+
+from config import settings
+
+
+class _BoundedDict(OrderedDict):
+    """LRU-ordered dict that drops its oldest entries beyond ``max_keys``."""
+
+    def __init__(self, max_keys: int):
+        super().__init__()
+        self.max_keys = max_keys
+
+    def put(self, key, value) -> None:
+        self[key] = value
+        self.move_to_end(key)
+        if len(self) > self.max_keys:
+            self.popitem(last=False)
+
+
+class MemoryBackend:
+    """Per-process token buckets and lockout counters.
+
+    Every method runs to completion on the event loop thread without awaiting,
+    so no locking is needed, and each call is a constant number of dict
+    operations. State is per worker; use ``RedisBackend`` to share it.
+    """
+
+    def __init__(self, max_keys: int = 100_000):
+        self._buckets = _BoundedDict(max_keys)
+        self._failures = _BoundedDict(max_keys)
+
+    async def take(self, key: str, rate: float, burst: int) -> float:
+        now = time.monotonic()
+        tokens, stamp = self._buckets.get(key, (float(burst), now))
+        tokens = min(float(burst), tokens + (now - stamp) * rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / rate
+        self._buckets.put(key, (tokens, now))
+        return wait
+
+    async def lockout_remaining(self, key: str) -> float:
+        entry = self._failures.get(key)
+        if entry is None:
+            return 0.0
+        return max(0.0, entry[1] - time.monotonic())
+
+    async def record_failure(self, key: str, threshold: int, base: int, cap: int, window: int) -> None:
+        now = time.monotonic()
+        count, locked_until, last = self._failures.get(key, (0, 0.0, now))
+        if now - last > window:
+            count = 0
+        count += 1
+        if count >= threshold:
+            locked_until = now + min(cap, base * 2 ** (count - threshold))
+        self._failures.put(key, (count, locked_until, now))
+
+    async def reset(self, key: str) -> None:
+        self._failures.pop(key, None)
+
+
+_TAKE_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= 1 then tokens = tokens - 1 else wait = (1 - tokens) / rate end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+_FAILURE_SCRIPT = """
+local threshold = tonumber(ARGV[1])
+local base = tonumber(ARGV[2])
+local cap = tonumber(ARGV[3])
+local n = redis.call('INCR', KEYS[1])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+if n >= threshold then
+  redis.call('SET', KEYS[2], '1', 'EX', math.min(cap, base * 2 ^ (n - threshold)))
+end
+return n
+"""
+
+
+class RedisBackend:
+    """Token buckets and lockouts shared by all workers through Redis.
+
+    Each operation is a single Lua script or command, so it is atomic across
+    workers and costs one round trip. Requires the optional ``redis`` package.
+    """
+
+    def __init__(self, url: str, prefix: str = "pidp:rl:"):
+        import redis.asyncio as redis
+
+        self._redis = redis.from_url(url)
+        self._prefix = prefix
+        self._take = self._redis.register_script(_TAKE_SCRIPT)
+        self._fail = self._redis.register_script(_FAILURE_SCRIPT)
+
+    async def take(self, key: str, rate: float, burst: int) -> float:
+        wait = await self._take(keys=[self._prefix + "b:" + key], args=[rate, burst, time.time()])
+        return float(wait)
+
+    async def lockout_remaining(self, key: str) -> float:
+        ttl = await self._redis.pttl(self._prefix + "l:" + key)
+        return max(0.0, ttl / 1000)
+
+    async def record_failure(self, key: str, threshold: int, base: int, cap: int, window: int) -> None:
+        await self._fail(
+            keys=[self._prefix + "f:" + key, self._prefix + "l:" + key],
+            args=[threshold, base, cap, window],
+        )
+
+    async def reset(self, key: str) -> None:
+        await self._redis.delete(self._prefix + "f:" + key, self._prefix + "l:" + key)
+
+
+class LoginLimiter:
+    """Admission checks for password logins, run before any hashing work.
+
+    Requests are limited per client IP and per account with token buckets.
+    Repeated failures lock out the (account, IP) pair with exponentially
+    growing durations, so failures from elsewhere never lock the user's own
+    IP out. The account bucket is shared by all IPs, though: it caps
+    distributed guessing, but while an attacker keeps it drained the user's
+    own logins compete for the same tokens and may get 429s.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    @staticmethod
+    def _account(username: str) -> str:
+        return username.strip().lower()
+
+    async def check(self, ip: str, username: str) -> float:
+        """Return 0 if the attempt may proceed, else seconds to wait."""
+        if not settings.login_rate_limit_enabled:
+            return 0.0
+        account = self._account(username)
+        locked = await self.backend.lockout_remaining(f"{account}|{ip}")
+        if locked:
+            return locked
+        wait = await self.backend.take(
+            "ip:" + ip, settings.login_ip_rate_per_minute / 60, settings.login_ip_burst
+        )
+        if wait:
+            return wait
+        return await self.backend.take(
+            "acct:" + account, settings.login_account_rate_per_minute / 60, settings.login_account_burst
+        )
+
+    async def failed(self, ip: str, username: str) -> None:
+        if not settings.login_rate_limit_enabled:
+            return
+        await self.backend.record_failure(
+            f"{self._account(username)}|{ip}",
+            settings.login_lockout_threshold,
+            settings.login_lockout_base_seconds,
+            settings.login_lockout_max_seconds,
+            settings.login_failure_window_seconds,
+        )
+
+    async def succeeded(self, ip: str, username: str) -> None:
+        if not settings.login_rate_limit_enabled:
+            return
+        await self.backend.reset(f"{self._account(username)}|{ip}")
+
+
+def build_login_limiter() -> LoginLimiter:
+    if settings.rate_limit_redis_url:
+        return LoginLimiter(RedisBackend(settings.rate_limit_redis_url))
+    return LoginLimiter(MemoryBackend())
+
+
+login_limiter = build_login_limiter()
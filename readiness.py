@@ -0,0 +1,288 @@
+"""Async readiness probes for bringing up the container stack.
+
+Probes talk to services directly from the orchestrator: plain TCP connects,
+the Postgres startup handshake (what ``pg_isready`` does) and HTTP requests.
+When the host cannot route to the Docker network (Docker Desktop, colima),
+the same checks run through ``docker exec`` in a single long-lived helper
+container instead of a fresh container per attempt.
+
+All probes for a bring-up step run concurrently, each retrying with capped
+exponential backoff until it succeeds or the shared deadline passes.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import random
+import shlex
+import struct
+import sys
+import threading
+import time
+from typing import Awaitable, Callable
+from urllib.parse import urlsplit
+
+import httpx
+
+
+HELPER_IMAGE = "postgres:15-alpine"  # ships pg_isready, nc and wget
+HELPER_NAME = "pidp_probe_helper"
+# SQLSTATE for "the database system is starting up" / "shutting down".
+_PG_NOT_READY = {b"57P03"}
+
+
+class ProbeFailed(Exception):
+    pass
+
+
+async def probe_tcp(host: str, port: int, timeout: float = 2.0) -> None:
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    except (OSError, asyncio.TimeoutError) as exc:
+        raise ProbeFailed(f"{host}:{port} not reachable: {exc or 'timeout'}") from exc
+    writer.close()
+
+
+async def probe_postgres(
+    host: str, port: int = 5432, user: str = "postgres", database: str = "postgres", timeout: float = 2.0
+) -> None:
+    """Send a startup message and accept any answer but "starting up".
+
+    Like ``pg_isready``, an authentication request or an auth/database error
+    means the server is accepting connections; no credentials are needed.
+    """
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    except (OSError, asyncio.TimeoutError) as exc:
+        raise ProbeFailed(f"postgres {host}:{port} not reachable: {exc or 'timeout'}") from exc
+    try:
+        params = b"user\0" + user.encode() + b"\0database\0" + database.encode() + b"\0\0"
+        writer.write(struct.pack("!ii", 8 + len(params), 196608) + params)
+        await writer.drain()
+        header = await asyncio.wait_for(reader.readexactly(5), timeout)
+        kind, length = header[:1], struct.unpack("!i", header[1:])[0]
+        if kind == b"R":
+            return
+        if kind != b"E":
+            raise ProbeFailed(f"postgres {host}:{port} sent unexpected message {kind!r}")
+        body = await asyncio.wait_for(reader.readexactly(length - 4), timeout)
+        fields = {field[:1]: field[1:] for field in body.split(b"\0") if field}
+        if fields.get(b"C") in _PG_NOT_READY:
+            raise ProbeFailed(f"postgres {host}:{port} is starting up")
+    except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError) as exc:
+        raise ProbeFailed(f"postgres {host}:{port} closed the connection") from exc
+    finally:
+        writer.close()
+
+
+async def probe_http(url: str, timeout: float = 5.0, client: httpx.AsyncClient | None = None) -> None:
+    """Succeeds on any status below 400, like ``curl -f``."""
+    try:
+        if client is not None:
+            response = await client.get(url, timeout=timeout)
+        else:
+            async with httpx.AsyncClient(verify=False, timeout=timeout) as http:
+                response = await http.get(url)
+    except httpx.HTTPError as exc:
+        raise ProbeFailed(f"{url} not reachable: {exc}") from exc
+    if response.status_code >= 400:
+        raise ProbeFailed(f"{url} returned {response.status_code}")
+
+
+class ProbeHelper:
+    """One long-lived container on the target network that runs checks via exec."""
+
+    def __init__(self, client, network: str, name: str = HELPER_NAME):
+        self.client = client
+        self.network = network
+        self.name = f"{name}_{network}"
+        self._container = None
+        self._lock = threading.Lock()
+
+    def _ensure(self):
+        # Probes call this from several threads at once; start one container.
+        with self._lock:
+            return self._start()
+
+    def _start(self):
+        if self._container is None:
+            from docker.errors import NotFound
+
+            try:
+                container = self.client.containers.get(self.name)
+                if container.status != "running":
+                    container.start()
+            except NotFound:
+                container = self.client.containers.run(
+                    HELPER_IMAGE,
+                    ["sleep", "infinity"],
+                    name=self.name,
+                    network=self.network,
+                    detach=True,
+                    auto_remove=True,
+                )
+            self._container = container
+        return self._container
+
+    async def run(self, command: str, description: str) -> None:
+        def run_sync():
+            return self._ensure().exec_run(["sh", "-c", command])
+
+        result = await asyncio.to_thread(run_sync)
+        if result.exit_code != 0:
+            raise ProbeFailed(f"{description} not ready")
+
+    async def tcp(self, host: str, port: int, timeout: float = 2.0) -> None:
+        await self.run(f"nc -z -w {max(1, int(timeout))} {shlex.quote(host)} {int(port)}", f"{host}:{port}")
+
+    async def postgres(
+        self, host: str, port: int = 5432, user: str = "postgres", database: str = "postgres", timeout: float = 2.0
+    ) -> None:
+        command = (
+            f"pg_isready -q -t {max(1, int(timeout))} -h {shlex.quote(host)} -p {int(port)} "
+            f"-U {shlex.quote(user)} -d {shlex.quote(database)}"
+        )
+        await self.run(command, f"postgres {host}:{port}")
+
+    async def http(self, url: str, timeout: float = 5.0) -> None:
+        await self.run(f"wget -q -O /dev/null -T {max(1, int(timeout))} {shlex.quote(url)}", url)
+
+    def close(self) -> None:
+        if self._container is not None:
+            try:
+                self._container.stop(timeout=1)
+            except Exception:
+                pass
+            self._container = None
+
+
+def host_can_reach_containers() -> bool:
+    """Container IPs are routable from the host only with a native Linux daemon."""
+    docker_host = os.environ.get("DOCKER_HOST", "")
+    return sys.platform.startswith("linux") and ("colima" not in docker_host) and not docker_host.startswith("tcp://")
+
+
+def container_address(client, name: str, network: str) -> str:
+    """IP of container ``name`` on ``network``; falls back to the name itself."""
+    try:
+        attrs = client.containers.get(name).attrs
+        return attrs["NetworkSettings"]["Networks"][network]["IPAddress"] or name
+    except Exception:
+        return name
+
+
+class Prober:
+    """Builds probes for services on a Docker network.
+
+    Probes connect directly when the host can route to container IPs (or
+    when ``network`` is None, for ports published on localhost) and go
+    through a shared ``ProbeHelper`` otherwise.
+    """
+
+    def __init__(self, client=None, network: str | None = None, direct: bool | None = None):
+        self.client = client
+        self.network = network
+        self.direct = network is None or (host_can_reach_containers() if direct is None else direct)
+        self.helper = None if self.direct else ProbeHelper(client, network)
+
+    async def _address(self, host: str) -> str:
+        if self.network is None or self.client is None:
+            return host
+        # Resolved per attempt: a container only gets its IP once it starts.
+        return await asyncio.to_thread(container_address, self.client, host, self.network)
+
+    def tcp(self, host: str, port: int) -> Callable[[], Awaitable[None]]:
+        async def probe():
+            if self.helper:
+                return await self.helper.tcp(host, port)
+            await probe_tcp(await self._address(host), port)
+
+        return probe
+
+    def postgres(self, host: str, port: int = 5432, user: str = "postgres", database: str = "postgres"):
+        async def probe():
+            if self.helper:
+                return await self.helper.postgres(host, port, user, database)
+            await probe_postgres(await self._address(host), port, user, database)
+
+        return probe
+
+    def http(self, url: str) -> Callable[[], Awaitable[None]]:
+        async def probe():
+            if self.helper:
+                return await self.helper.http(url)
+            parts = urlsplit(url)
+            address = await self._address(parts.hostname or "localhost")
+            netloc = address if parts.port is None else f"{address}:{parts.port}"
+            await probe_http(parts._replace(netloc=netloc).geturl())
+
+        return probe
+
+    def close(self) -> None:
+        if self.helper:
+            self.helper.close()
+
+
+def run_probes(
+    prober: Prober, probes: dict[str, Callable[[], Awaitable[None]]], deadline: float = 120.0
+) -> dict[str, float]:
+    """Synchronous entry point for the orchestration scripts."""
+    try:
+        return asyncio.run(wait_for(probes, deadline=deadline))
+    finally:
+        prober.close()
+
+
+async def wait_for(
+    probes: dict[str, Callable[[], Awaitable[None]]],
+    deadline: float = 120.0,
+    initial_delay: float = 0.1,
+    max_delay: float = 2.0,
+    log: Callable[[str], None] = print,
+) -> dict[str, float]:
+    """Run all probes concurrently until each succeeds once.
+
+    Returns seconds until each probe first succeeded. Raises ``TimeoutError``
+    naming the services that were still unready (with their last error) when
+    ``deadline`` seconds have passed.
+    """
+    started = time.monotonic()
+    give_up = started + deadline
+    last_error: dict[str, str] = {}
+
+    async def run(name: str, probe: Callable[[], Awaitable[None]]) -> float:
+        delay = initial_delay
+        while True:
+            try:
+                await probe()
+                elapsed = time.monotonic() - started
+                log(f"{name} is ready ({elapsed:.1f}s)")
+                return elapsed
+            except Exception as exc:
+                # Anything else a probe raises (a client library error, say)
+                # is retried like a failure; repr keeps its type visible.
+                message = str(exc) if isinstance(exc, ProbeFailed) else repr(exc)
+                if message != last_error.get(name):
+                    log(f"Waiting for {name}: {message}")
+                last_error[name] = message
+            remaining = give_up - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(name)
+            # Full jitter keeps concurrent bring-ups from probing in lockstep.
+            await asyncio.sleep(min(remaining, random.uniform(0, delay) + initial_delay))
+            delay = min(max_delay, delay * 2)
+
+    results = await asyncio.gather(*(run(name, probe) for name, probe in probes.items()), return_exceptions=True)
+    pending = [name for name, result in zip(probes, results) if isinstance(result, BaseException)]
+    if pending:
+        details = "; ".join(f"{name}: {last_error.get(name, 'no response')}" for name in pending)
+        raise TimeoutError(f"Not ready after {deadline:.0f}s: {details}")
+    return dict(zip(probes, results))
+
+
+def parse_address(url: str, default_port: int) -> tuple[str, int]:
+    """Host and port from ``host:port`` or a full URL such as a DATABASE_URL."""
+    if "://" not in url:
+        url = "//" + url
+    parts = urlsplit(url)
+    return parts.hostname or "localhost", parts.port or default_port
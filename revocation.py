@@ -0,0 +1,84 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.postgresql import insert
+
+from config import settings
+from db import SessionLocal
+from models import RevokedToken
+
+
+logger = logging.getLogger(__name__)
+
+# Revocations can commit out of order across workers; re-read a short overlap.
+_REFRESH_OVERLAP = timedelta(seconds=30)
+
+
+class RevocationList:
+    """In-memory set of revoked token ids (``jti``), mirrored from the DB.
+
+    Checking a token is a dict lookup with no DB round trip. Revocations made
+    by other workers become visible after the next refresh, at most
+    ``revocation_refresh_seconds`` later. Entries are dropped once the token
+    would have expired anyway.
+    """
+
+    def __init__(self):
+        self._revoked: dict[str, float] = {}
+        self._watermark: datetime | None = None
+
+    def is_revoked(self, claims: dict) -> bool:
+        jti = claims.get("jti")
+        return bool(jti) and jti in self._revoked
+
+    async def revoke(self, claims: dict) -> bool:
+        jti = claims.get("jti")
+        if not jti:
+            return False
+        expires_at = datetime.fromtimestamp(claims.get("exp", time.time()), tz=timezone.utc)
+        async with SessionLocal() as session:
+            await session.execute(
+                insert(RevokedToken).values(jti=jti, expires_at=expires_at).on_conflict_do_nothing()
+            )
+            await session.commit()
+        self._revoked[jti] = expires_at.timestamp()
+        return True
+
+    async def refresh(self) -> None:
+        now = datetime.now(timezone.utc)
+        since = self._watermark - _REFRESH_OVERLAP if self._watermark else None
+        query = select(RevokedToken.jti, RevokedToken.expires_at, RevokedToken.revoked_at).where(
+            RevokedToken.expires_at > now
+        )
+        if since:
+            query = query.where(RevokedToken.revoked_at >= since)
+        async with SessionLocal() as session:
+            rows = (await session.execute(query)).all()
+            # Expired revocations are no longer needed; any worker may prune them.
+            await session.execute(delete(RevokedToken).where(RevokedToken.expires_at <= now))
+            await session.commit()
+        for jti, expires_at, revoked_at in rows:
+            self._revoked[jti] = expires_at.timestamp()
+            if self._watermark is None or revoked_at > self._watermark:
+                self._watermark = revoked_at
+        if self._watermark is None:
+            self._watermark = now
+        cutoff = now.timestamp()
+        for jti in [jti for jti, expiry in self._revoked.items() if expiry <= cutoff]:
+            del self._revoked[jti]
+
+    async def run_refresher(self) -> None:
+        while True:
+            try:
+                await self.refresh()
+            except Exception:
+                logger.exception("Refreshing revoked tokens failed")
+            await asyncio.sleep(settings.revocation_refresh_seconds)
+
+
+revocation_list = RevocationList()
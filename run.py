@@ -2,15 +2,36 @@ import os
 from pathlib import Path
 import json
 import sys
+from urllib.parse import urlsplit
 import docker_utils
+from orchestrate import Build, Service, ServiceGraph
 current_dir = Path(os.path.abspath(os.path.dirname(__file__)))
 sys.path.insert(0, str(current_dir))
 container_app_dir = "/app"
 
 
-def run(prefix, NETWORK_NAME):
+DEV_COMMAND = [
+    "uvicorn",
+    "main:app",
+    "--host",
+    "0.0.0.0",
+    "--port",
+    "8000",
+    "--reload",
+    "--reload-dir",
+    container_app_dir,
+]
+PROD_COMMAND = ["gunicorn", "main:app", "-c", "gunicorn_conf.py"]
+
+
+PIDP_IMAGE = "pidp"
+
+
+def run(prefix, NETWORK_NAME, dev_reload=None):
     docker_utils.initializeFiles(current_dir)
     import pidp_editme
+    if dev_reload is None:
+        dev_reload = getattr(pidp_editme, "PIDP_DEV_RELOAD", False)
     PIDP_DB = dict(
         image="postgres:15-alpine",
         detach=True,
@@ -38,16 +59,15 @@ def run(prefix, NETWORK_NAME):
     )
     PIDP_DB_URL = f"postgresql+asyncpg://{pidp_editme.PIDP_POSTGRES_USER}:{pidp_editme.PIDP_POSTGRES_PASSWORD}@{prefix}pidpdb:5432/PIdP"
     PIDP_RUNDICT = dict(
-        image="pidp",
+        image=PIDP_IMAGE,
         name=prefix+"pidp",
         volumes={
-            str(current_dir): {"bind": container_app_dir, "mode": "rw"},
+            str(current_dir): {"bind": container_app_dir, "mode": "rw" if dev_reload else "ro"},
         },
         environment={
             "DATABASE_URL": PIDP_DB_URL,
             "SECRET_KEY": pidp_editme.PIDP_SECRET_KEY,
             "AUTO_CREATE_TABLES": "true",
-            "WATCHFILES_FORCE_POLLING": "true",
             "FRONTEND_REDIRECT_URL": pidp_editme.PIDP_FRONTEND_REDIRECT_URL,
             "GOOGLE_CLIENT_ID": pidp_editme.PIDP_GOOGLE_CLIENT_ID,
             "GOOGLE_CLIENT_SECRET": pidp_editme.PIDP_GOOGLE_CLIENT_SECRET,
@@ -68,18 +88,55 @@ def run(prefix, NETWORK_NAME):
         network=NETWORK_NAME,
         restart_policy={"Name": "always"},
         detach=True,
-        command=[
-            "uvicorn",
-            "main:app",
-            "--host",
-            "0.0.0.0",
-            "--port",
-            "8000",
-            "--reload",
-            "--reload-dir",
-            container_app_dir,
-        ],
+        command=DEV_COMMAND if dev_reload else PROD_COMMAND,
+    )
+    if dev_reload:
+        PIDP_RUNDICT["environment"]["WATCHFILES_FORCE_POLLING"] = "true"
+    web_concurrency = getattr(pidp_editme, "PIDP_WEB_CONCURRENCY", None)
+    if web_concurrency:
+        PIDP_RUNDICT["environment"]["WEB_CONCURRENCY"] = str(web_concurrency)
+
+    graph = ServiceGraph(NETWORK_NAME)
+    db_user = pidp_editme.PIDP_POSTGRES_USER
+    graph.add(
+        Service(
+            "pidpdb",
+            PIDP_DB,
+            ready=lambda probe: probe.postgres(PIDP_DB["name"], 5432, db_user, "PIdP"),
+        )
+    )
+    app_depends = ["pidpdb"]
+    if getattr(pidp_editme, "PIDP_BUILD_IMAGE", True):
+        graph.add(Build("pidp-image", str(current_dir), PIDP_IMAGE))
+        app_depends.append("pidp-image")
+    if getattr(pidp_editme, "PIDP_RUN_MINIO", False):
+        minio_host = urlsplit(pidp_editme.MINIO_ENDPOINT).hostname
+        graph.add(
+            Service(
+                "minio",
+                dict(
+                    image="minio/minio:latest",
+                    name=minio_host,
+                    command=["server", "/data"],
+                    network=NETWORK_NAME,
+                    restart_policy={"Name": "always"},
+                    detach=True,
+                    environment={
+                        "MINIO_ROOT_USER": pidp_editme.MINIO_ACCESS_KEY,
+                        "MINIO_ROOT_PASSWORD": pidp_editme.MINIO_SECRET_KEY,
+                    },
+                    volumes={prefix + "PIdP_MINIO": {"bind": "/data", "mode": "rw"}},
+                ),
+                ready=lambda probe: probe.http(pidp_editme.MINIO_ENDPOINT.rstrip("/") + "/minio/health/live"),
+            )
+        )
+        app_depends.append("minio")
+    graph.add(
+        Service(
+            "pidp",
+            PIDP_RUNDICT,
+            depends_on=tuple(app_depends),
+            ready=lambda probe: probe.http(f"http://{PIDP_RUNDICT['name']}:8000/health"),
+        )
     )
-    docker_utils.run_container(PIDP_DB)
-    docker_utils.wait_for_db(NETWORK_NAME,db_url=PIDP_DB_URL,db_user=pidp_editme.PIDP_POSTGRES_USER)
-    docker_utils.run_container(PIDP_RUNDICT)
+    return graph.up()
@@ -28,6 +28,8 @@ class UserPublic(BaseModel):
 class Token(BaseModel):
     access_token: str
     token_type: str = "bearer"
+    expires_in: int | None = None
+    scope: str | None = None
 
 
 class TokenData(BaseModel):
@@ -55,3 +57,23 @@ class UserPublicProfile(BaseModel):
     full_name: str | None = None
     display_name: str | None = None
     avatar_url: str | None = None
+
+
+class ClientCreate(BaseModel):
+    name: str
+    scopes: list[str] = Field(default_factory=list)
+
+
+class ClientCredentials(BaseModel):
+    client_id: str
+    client_secret: str
+    name: str
+    scopes: list[str]
+
+
+class IntrospectionBatch(BaseModel):
+    tokens: list[str]
+
+
+class AvatarUploadComplete(BaseModel):
+    object_key: str
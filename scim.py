@@ -0,0 +1,626 @@
+from __future__ import annotations
+
+import base64
+import json
+import re
+import uuid
+from datetime import datetime, timezone
+
+from fastapi import APIRouter, Depends, Request, status
+from pydantic import EmailStr, TypeAdapter, ValidationError
+from sqlalchemy import delete, func, select, tuple_, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.responses import JSONResponse, Response
+
+from bloom import known_emails
+from config import settings
+from db import get_read_session, get_session
+from dependencies import require_provisioning
+from models import User
+from outbox import USER_CREATED, USER_DELETED, USER_UPDATED, outbox_relay, record_event, record_user_event, user_payload
+from schemas import UserProfileUpdate
+
+
+USER_SCHEMA = "urn:ietf:params:scim:schemas:core:2.0:User"
+LIST_SCHEMA = "urn:ietf:params:scim:api:messages:2.0:ListResponse"
+ERROR_SCHEMA = "urn:ietf:params:scim:api:messages:2.0:Error"
+BULK_RESPONSE_SCHEMA = "urn:ietf:params:scim:api:messages:2.0:BulkResponse"
+MEDIA_TYPE = "application/scim+json"
+
+router = APIRouter(prefix="/scim/v2", dependencies=[Depends(require_provisioning)])
+
+# Supported SCIM attribute paths (lower-cased, as SCIM names are
+# case-insensitive) and where they live on User. Profile keys are stored in
+# identity_data and validated through UserProfileUpdate.
+_ATTRIBUTES = {
+    "username": ("email", None),
+    "emails": ("email", None),
+    "emails.value": ("email", None),
+    "active": ("is_active", None),
+    "name.formatted": ("full_name", None),
+    "name.givenname": ("profile", "first_name"),
+    "name.familyname": ("profile", "last_name"),
+    "displayname": ("profile", "display_name"),
+    "photos": ("profile", "avatar_url"),
+    "photos.value": ("profile", "avatar_url"),
+}
+_EMAIL = TypeAdapter(EmailStr)
+_FILTER_TERM = re.compile(r'\s*([\w.:]+)\s+(eq|ne|co|sw|ew|pr)\b\s*("(?:[^"\\]|\\.)*"|true|false)?\s*', re.I)
+_FILTER_AND = re.compile(r"and\s+", re.I)
+
+
+class ScimError(Exception):
+    def __init__(self, status_code: int, detail: str, scim_type: str | None = None):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.scim_type = scim_type
+
+    def body(self) -> dict:
+        body = {"schemas": [ERROR_SCHEMA], "status": str(self.status_code), "detail": self.detail}
+        if self.scim_type:
+            body["scimType"] = self.scim_type
+        return body
+
+
+def _response(body: dict, status_code: int = 200, location: str | None = None) -> JSONResponse:
+    headers = {"Location": location} if location else None
+    return JSONResponse(body, status_code=status_code, media_type=MEDIA_TYPE, headers=headers)
+
+
+def _error(exc: ScimError) -> JSONResponse:
+    return _response(exc.body(), exc.status_code)
+
+
+def _location(user_id) -> str:
+    return f"{router.prefix}/Users/{user_id}"
+
+
+def _require_object(value, what: str) -> dict:
+    if not isinstance(value, dict):
+        raise ScimError(400, f"{what} must be a JSON object", "invalidSyntax")
+    return value
+
+
+async def _json_body(request: Request) -> dict:
+    try:
+        body = await request.json()
+    except ValueError:
+        raise ScimError(400, "Request body is not valid JSON", "invalidSyntax")
+    return _require_object(body, "Request body")
+
+
+def _to_resource(user: User) -> dict:
+    identity = user.identity_data or {}
+    resource = {
+        "schemas": [USER_SCHEMA],
+        "id": str(user.id),
+        "userName": user.email,
+        "name": {
+            "formatted": user.full_name,
+            "givenName": identity.get("first_name"),
+            "familyName": identity.get("last_name"),
+        },
+        "displayName": identity.get("display_name"),
+        "active": user.is_active,
+        "emails": [{"value": user.email, "primary": True}],
+        "meta": {
+            "resourceType": "User",
+            "created": user.created_at.isoformat() if user.created_at else None,
+            "location": _location(user.id),
+        },
+    }
+    if identity.get("avatar_url"):
+        resource["photos"] = [{"value": identity["avatar_url"], "type": "photo"}]
+    return resource
+
+
+def _normalize_path(path: str) -> str:
+    # emails[type eq "work"].value -> emails.value
+    path = re.sub(r"\[.*?\]", "", path).lower()
+    prefix = USER_SCHEMA.lower() + ":"
+    return path[len(prefix):] if path.startswith(prefix) else path
+
+
+def _set(changes: dict, path: str, value) -> None:
+    path = _normalize_path(path)
+    if isinstance(value, dict) and path in ("", "name"):
+        for key, item in value.items():
+            _set(changes, f"{path}.{key}" if path else key, item)
+        return
+    target = _ATTRIBUTES.get(path)
+    if target is None:
+        # Unsupported attributes (externalId, title, ...) are ignored.
+        return
+    if isinstance(value, list):
+        primary = next((item for item in value if isinstance(item, dict) and item.get("primary")), None)
+        item = primary or (value[0] if value else None)
+        value = item.get("value") if isinstance(item, dict) else item
+    field, key = target
+    if field == "profile":
+        changes.setdefault("profile", {})[key] = value
+    else:
+        changes[field] = value
+
+
+def _resource_changes(data: dict, replace: bool = False) -> dict:
+    _require_object(data, "Resource")
+    changes: dict = {}
+    if replace:
+        # PUT replaces the resource: supported attributes that are omitted are cleared.
+        changes = {
+            "full_name": None,
+            "is_active": True,
+            "profile": {"first_name": None, "last_name": None, "display_name": None, "avatar_url": None},
+        }
+    for key, value in data.items():
+        if key in ("schemas", "id", "meta"):
+            continue
+        _set(changes, key, value)
+    return changes
+
+
+def _patch_changes(data: dict) -> dict:
+    changes: dict = {}
+    operations = _require_object(data, "PatchOp").get("Operations") or []
+    if not isinstance(operations, list):
+        raise ScimError(400, "Operations must be a list", "invalidSyntax")
+    for operation in operations:
+        _require_object(operation, "Patch operation")
+        op = str(operation.get("op", "")).lower()
+        path = str(operation.get("path") or "")
+        if op in ("add", "replace"):
+            _set(changes, path, operation.get("value"))
+        elif op == "remove":
+            if not path:
+                raise ScimError(400, "remove requires a path", "noTarget")
+            _set(changes, path, None)
+        else:
+            raise ScimError(400, f"Unsupported patch op {op!r}", "invalidSyntax")
+    return changes
+
+
+def _validate(changes: dict, creating: bool = False) -> dict:
+    if "email" in changes or creating:
+        if not changes.get("email"):
+            raise ScimError(400, "userName is required", "invalidValue")
+        try:
+            changes["email"] = str(_EMAIL.validate_python(changes["email"]))
+        except ValidationError:
+            raise ScimError(400, "userName must be an email address", "invalidValue")
+    if "is_active" in changes:
+        value = changes["is_active"]
+        changes["is_active"] = value.lower() == "true" if isinstance(value, str) else bool(value)
+    try:
+        UserProfileUpdate(full_name=changes.get("full_name"), **changes.get("profile", {}))
+    except (ValidationError, TypeError) as exc:
+        raise ScimError(400, str(exc), "invalidValue")
+    return changes
+
+
+def _apply(values: dict, changes: dict) -> dict:
+    for field in ("email", "full_name", "is_active"):
+        if field in changes:
+            values[field] = changes[field]
+    if changes.get("profile"):
+        identity = dict(values.get("identity_data") or {})
+        identity.update(changes["profile"])
+        values["identity_data"] = identity
+    return values
+
+
+def _apply_to_user(user: User, changes: dict) -> None:
+    values = _apply(
+        {
+            "email": user.email,
+            "full_name": user.full_name,
+            "is_active": user.is_active,
+            "identity_data": user.identity_data,
+        },
+        changes,
+    )
+    for field, value in values.items():
+        if getattr(user, field) != value:
+            setattr(user, field, value)
+
+
+def _parse_id(value: str) -> uuid.UUID:
+    try:
+        return uuid.UUID(value)
+    except ValueError:
+        raise ScimError(404, f"User {value} not found")
+
+
+def _filter_clause(expression: str):
+    clauses = []
+    pos = 0
+    while pos < len(expression):
+        match = _FILTER_TERM.match(expression, pos)
+        if not match:
+            raise ScimError(400, f"Unsupported filter: {expression}", "invalidFilter")
+        path, op, raw = match.group(1), match.group(2).lower(), match.group(3)
+        clauses.append(_filter_term(path, op, raw))
+        pos = match.end()
+        if pos < len(expression):
+            joiner = _FILTER_AND.match(expression, pos)
+            if not joiner:
+                raise ScimError(400, "Only 'and' is supported in filters", "invalidFilter")
+            pos = joiner.end()
+    return clauses
+
+
+def _filter_term(path: str, op: str, raw: str | None):
+    normalized = _normalize_path(path)
+    if normalized == "id":
+        column, kind = User.id, "id"
+    else:
+        target = _ATTRIBUTES.get(normalized)
+        if target is None:
+            raise ScimError(400, f"Unsupported filter attribute {path}", "invalidFilter")
+        field, key = target
+        column = User.identity_data[key].astext if field == "profile" else getattr(User, field)
+        kind = "boolean" if field == "is_active" else "string"
+    if op == "pr":
+        return column.is_not(None)
+    if op in ("co", "sw", "ew") and kind != "string":
+        raise ScimError(400, f"Operator {op} is not supported for {path}", "invalidFilter")
+    if raw is None:
+        raise ScimError(400, f"Missing value for {path} {op}", "invalidFilter")
+    value = json.loads(raw)
+    if kind == "id":
+        try:
+            value = uuid.UUID(str(value))
+        except ValueError:
+            raise ScimError(400, f"Invalid id {value!r}", "invalidValue")
+    elif not isinstance(value, bool if kind == "boolean" else str):
+        raise ScimError(400, f"Invalid value {raw} for {path}", "invalidFilter")
+    if kind == "string":
+        # userName, emails and the name attributes are not caseExact (RFC
+        # 7643); lower(email) has its own index.
+        column, value = func.lower(column), value.lower()
+    if op == "eq":
+        return column == value
+    if op == "ne":
+        return column != value
+    pattern = {"co": "%{}%", "sw": "{}%", "ew": "%{}"}[op].format(str(value).replace("%", r"\%").replace("_", r"\_"))
+    return column.ilike(pattern)
+
+
+def _encode_cursor(user: User) -> str:
+    raw = json.dumps([user.created_at.isoformat(), str(user.id)]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _decode_cursor(cursor: str):
+    try:
+        created_at, user_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return datetime.fromisoformat(created_at), uuid.UUID(user_id)
+    except (ValueError, TypeError):
+        raise ScimError(400, "Invalid cursor", "invalidCursor")
+
+
+@router.get("/ServiceProviderConfig")
+async def service_provider_config() -> JSONResponse:
+    return _response(
+        {
+            "schemas": ["urn:ietf:params:scim:schemas:core:2.0:ServiceProviderConfig"],
+            "patch": {"supported": True},
+            "bulk": {"supported": True, "maxOperations": settings.scim_bulk_max_operations, "maxPayloadSize": 10_485_760},
+            "filter": {"supported": True, "maxResults": settings.scim_max_page_size},
+            "changePassword": {"supported": False},
+            "sort": {"supported": False},
+            "etag": {"supported": False},
+            "pagination": {"cursor": True, "index": True, "defaultPaginationMethod": "cursor"},
+            "authenticationSchemes": [{"type": "oauthbearertoken", "name": "OAuth Bearer Token"}],
+        }
+    )
+
+
+@router.get("/Users")
+async def list_users(
+    filter: str | None = None,
+    startIndex: int = 1,
+    count: int = 100,
+    cursor: str | None = None,
+    session: AsyncSession = Depends(get_read_session),
+) -> JSONResponse:
+    """List users, filtered, with either cursor or index pagination.
+
+    Passing ``cursor`` (empty for the first page) selects keyset pagination
+    on ``(created_at, id)``, which stays fast on deep pages and skips the
+    ``totalResults`` count.
+    """
+    try:
+        clauses = _filter_clause(filter) if filter else []
+        count = max(0, min(count, settings.scim_max_page_size))
+        query = select(User).where(*clauses).order_by(User.created_at, User.id).limit(count)
+        body = {"schemas": [LIST_SCHEMA]}
+        if cursor is not None:
+            if cursor:
+                query = query.where(tuple_(User.created_at, User.id) > _decode_cursor(cursor))
+            users = (await session.execute(query)).scalars().all()
+            if len(users) == count and users:
+                body["nextCursor"] = _encode_cursor(users[-1])
+        else:
+            start = max(startIndex, 1)
+            total = (await session.execute(select(func.count()).select_from(User).where(*clauses))).scalar_one()
+            users = (await session.execute(query.offset(start - 1))).scalars().all()
+            body["totalResults"] = total
+            body["startIndex"] = start
+    except ScimError as exc:
+        return _error(exc)
+    body["itemsPerPage"] = len(users)
+    body["Resources"] = [_to_resource(user) for user in users]
+    return _response(body)
+
+
+@router.get("/Users/{user_id}")
+async def get_user(user_id: str, session: AsyncSession = Depends(get_read_session)) -> JSONResponse:
+    try:
+        user = await session.get(User, _parse_id(user_id))
+        if not user:
+            raise ScimError(404, f"User {user_id} not found")
+    except ScimError as exc:
+        return _error(exc)
+    return _response(_to_resource(user))
+
+
+@router.post("/Users")
+async def create_user(request: Request, session: AsyncSession = Depends(get_session)) -> JSONResponse:
+    try:
+        changes = _validate(_resource_changes(await _json_body(request)), creating=True)
+        user = User(email=changes["email"], identity_data={}, is_active=True)
+        _apply_to_user(user, changes)
+        session.add(user)
+        record_user_event(session, USER_CREATED, user)
+        try:
+            await session.commit()
+        except IntegrityError:
+            raise ScimError(409, "User already exists", "uniqueness")
+    except ScimError as exc:
+        return _error(exc)
+    outbox_relay.notify()
+    await session.refresh(user)
+    known_emails.add(user.email)
+    return _response(_to_resource(user), status.HTTP_201_CREATED, _location(user.id))
+
+
+async def _update_user(user_id: str, changes_for, session: AsyncSession) -> JSONResponse:
+    try:
+        user = await session.get(User, _parse_id(user_id), with_for_update=True)
+        if not user:
+            raise ScimError(404, f"User {user_id} not found")
+        _apply_to_user(user, _validate(changes_for()))
+        record_user_event(session, USER_UPDATED, user)
+        try:
+            await session.commit()
+        except IntegrityError:
+            raise ScimError(409, "userName is already taken", "uniqueness")
+    except ScimError as exc:
+        return _error(exc)
+    outbox_relay.notify()
+    await session.refresh(user)
+    known_emails.add(user.email)
+    return _response(_to_resource(user))
+
+
+@router.put("/Users/{user_id}")
+async def replace_user(user_id: str, request: Request, session: AsyncSession = Depends(get_session)) -> JSONResponse:
+    try:
+        data = await _json_body(request)
+    except ScimError as exc:
+        return _error(exc)
+    return await _update_user(user_id, lambda: _resource_changes(data, replace=True), session)
+
+
+@router.patch("/Users/{user_id}")
+async def patch_user(user_id: str, request: Request, session: AsyncSession = Depends(get_session)) -> JSONResponse:
+    try:
+        data = await _json_body(request)
+    except ScimError as exc:
+        return _error(exc)
+    return await _update_user(user_id, lambda: _patch_changes(data), session)
+
+
+@router.delete("/Users/{user_id}")
+async def delete_user(user_id: str, session: AsyncSession = Depends(get_session)) -> Response:
+    try:
+        result = await session.execute(delete(User).where(User.id == _parse_id(user_id)).returning(User.id))
+        deleted_id = result.scalar_one_or_none()
+        if deleted_id is None:
+            raise ScimError(404, f"User {user_id} not found")
+    except ScimError as exc:
+        return _error(exc)
+    record_event(session, USER_DELETED, deleted_id, {"id": str(deleted_id)})
+    await session.commit()
+    outbox_relay.notify()
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+def _bulk_result(operation: dict, status_code: int, location: str | None = None, error: ScimError | None = None) -> dict:
+    result = {"method": operation.get("method"), "status": str(status_code)}
+    if operation.get("bulkId"):
+        result["bulkId"] = operation["bulkId"]
+    if location:
+        result["location"] = location
+    if error:
+        result["response"] = error.body()
+    return result
+
+
+def _rolled_back(results: list[dict]) -> list[dict]:
+    error = ScimError(424, "Not applied: failOnErrors was reached and the bulk request was rolled back")
+    rolled_back = []
+    for result in results:
+        if int(result["status"]) < 400:
+            result = {key: value for key, value in result.items() if key != "location"}
+            result["status"] = str(error.status_code)
+            result["response"] = error.body()
+        rolled_back.append(result)
+    return rolled_back
+
+
+@router.post("/Bulk")
+async def bulk(request: Request, session: AsyncSession = Depends(get_session)) -> JSONResponse:
+    """Apply many operations in one transaction with batched statements.
+
+    Operations are grouped rather than run one by one: all creates become
+    one multi-row INSERT, all updates one SELECT ... FOR UPDATE plus one
+    executemany UPDATE, and all deletes one DELETE. Creates therefore run
+    before updates and deletes, so ``bulkId:`` references to users created
+    in the same request resolve. If ``failOnErrors`` is reached, the whole
+    transaction is rolled back and only the results up to the operation that
+    reached it are returned, with operations that would have succeeded
+    reported as 424 since none of their changes were kept.
+    """
+    try:
+        body = await _json_body(request)
+        operations = body.get("Operations") or []
+        if not isinstance(operations, list):
+            raise ScimError(400, "Operations must be a list", "invalidSyntax")
+        for operation in operations:
+            _require_object(operation, "Bulk operation")
+        fail_on_errors = body.get("failOnErrors")
+        if fail_on_errors is not None and (
+            isinstance(fail_on_errors, bool) or not isinstance(fail_on_errors, int) or fail_on_errors < 1
+        ):
+            raise ScimError(400, "failOnErrors must be a positive integer", "invalidSyntax")
+    except ScimError as exc:
+        return _error(exc)
+    if len(operations) > settings.scim_bulk_max_operations:
+        return _error(ScimError(413, f"At most {settings.scim_bulk_max_operations} operations per request", "tooMany"))
+    results: list[dict | None] = [None] * len(operations)
+    creates: list[tuple[int, dict]] = []
+    updates: list[tuple[int, str, dict]] = []
+    deletes: list[tuple[int, str]] = []
+
+    for index, operation in enumerate(operations):
+        method = str(operation.get("method", "")).upper()
+        path = str(operation.get("path", "")).rstrip("/")
+        data = operation.get("data") or {}
+        try:
+            if method in ("POST", "PUT", "PATCH"):
+                _require_object(data, "Bulk operation data")
+            if method == "POST" and path == "/Users":
+                creates.append((index, _validate(_resource_changes(data), creating=True)))
+            elif method in ("PUT", "PATCH") and path.startswith("/Users/"):
+                changes = _resource_changes(data, replace=True) if method == "PUT" else _patch_changes(data)
+                updates.append((index, path[len("/Users/"):], _validate(changes)))
+            elif method == "DELETE" and path.startswith("/Users/"):
+                deletes.append((index, path[len("/Users/"):]))
+            else:
+                raise ScimError(400, f"Unsupported bulk operation {method} {path}", "invalidSyntax")
+        except ScimError as exc:
+            results[index] = _bulk_result(operation, exc.status_code, error=exc)
+
+    bulk_ids: dict[str, uuid.UUID] = {}
+    touched_emails: list[str] = []
+    try:
+        if creates:
+            now = datetime.now(timezone.utc)
+            rows = []
+            for index, changes in creates:
+                values = _apply({"email": changes["email"], "full_name": None, "is_active": True, "identity_data": {}}, changes)
+                rows.append({"id": uuid.uuid4(), "created_at": now, **values})
+            inserted = set(
+                (await session.execute(insert(User).values(rows).on_conflict_do_nothing().returning(User.id))).scalars()
+            )
+            for (index, changes), row in zip(creates, rows):
+                operation = operations[index]
+                if row["id"] in inserted:
+                    if operation.get("bulkId"):
+                        bulk_ids[operation["bulkId"]] = row["id"]
+                    touched_emails.append(row["email"])
+                    payload = user_payload(row["id"], row["email"], row["full_name"], row["is_active"], row["identity_data"])
+                    record_event(session, USER_CREATED, row["id"], payload)
+                    results[index] = _bulk_result(operation, 201, _location(row["id"]))
+                else:
+                    error = ScimError(409, "User already exists", "uniqueness")
+                    results[index] = _bulk_result(operation, 409, error=error)
+
+        def resolve(reference: str) -> uuid.UUID:
+            if reference.startswith("bulkId:"):
+                if reference[len("bulkId:"):] not in bulk_ids:
+                    raise ScimError(409, f"Unresolved reference {reference}", "invalidValue")
+                return bulk_ids[reference[len("bulkId:"):]]
+            return _parse_id(reference)
+
+        if updates:
+            resolved = []
+            for index, reference, changes in updates:
+                try:
+                    resolved.append((index, resolve(reference), changes))
+                except ScimError as exc:
+                    results[index] = _bulk_result(operations[index], exc.status_code, error=exc)
+            ids = {user_id for _, user_id, _ in resolved}
+            current = {
+                user.id: {
+                    "id": user.id,
+                    "email": user.email,
+                    "full_name": user.full_name,
+                    "is_active": user.is_active,
+                    "identity_data": user.identity_data,
+                }
+                for user in (
+                    await session.execute(select(User).where(User.id.in_(ids)).with_for_update())
+                ).scalars()
+            }
+            changed = {}
+            for index, user_id, changes in resolved:
+                if user_id not in current:
+                    error = ScimError(404, f"User {user_id} not found")
+                    results[index] = _bulk_result(operations[index], 404, error=error)
+                    continue
+                changed[user_id] = _apply(current[user_id], changes)
+                results[index] = _bulk_result(operations[index], 200, _location(user_id))
+            if changed:
+                await session.execute(update(User), list(changed.values()))
+                for values in changed.values():
+                    touched_emails.append(values["email"])
+                    payload = user_payload(
+                        values["id"], values["email"], values["full_name"], values["is_active"], values["identity_data"]
+                    )
+                    record_event(session, USER_UPDATED, values["id"], payload)
+
+        if deletes:
+            resolved = []
+            for index, reference in deletes:
+                try:
+                    resolved.append((index, resolve(reference)))
+                except ScimError as exc:
+                    results[index] = _bulk_result(operations[index], exc.status_code, error=exc)
+            removed = set(
+                (
+                    await session.execute(
+                        delete(User).where(User.id.in_([user_id for _, user_id in resolved])).returning(User.id)
+                    )
+                ).scalars()
+            )
+            for index, user_id in resolved:
+                if user_id in removed:
+                    results[index] = _bulk_result(operations[index], 204)
+                    record_event(session, USER_DELETED, user_id, {"id": str(user_id)})
+                else:
+                    error = ScimError(404, f"User {user_id} not found")
+                    results[index] = _bulk_result(operations[index], 404, error=error)
+    except IntegrityError:
+        await session.rollback()
+        return _error(ScimError(409, "Bulk request violates a uniqueness constraint", "uniqueness"))
+
+    if fail_on_errors:
+        errors = 0
+        for index, result in enumerate(results):
+            if result and int(result["status"]) >= 400:
+                errors += 1
+                if errors >= fail_on_errors:
+                    # Stop at the operation that reached the limit, as RFC 7644 does.
+                    await session.rollback()
+                    reported = _rolled_back(results[: index + 1])
+                    return _response({"schemas": [BULK_RESPONSE_SCHEMA], "Operations": reported})
+    await session.commit()
+    outbox_relay.notify()
+    for email in touched_emails:
+        known_emails.add(email)
+    return _response({"schemas": [BULK_RESPONSE_SCHEMA], "Operations": results})
@@ -1,21 +1,73 @@
 from __future__ import annotations
 
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
 from jose import JWTError, jwt, jwk
 from jose.utils import base64url_encode
 import hashlib
-from cryptography.hazmat.primitives import serialization
-from cryptography.hazmat.primitives.asymmetric import rsa
-from passlib.context import CryptContext
-from sqlalchemy import select
+import hmac
+from sqlalchemy import select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from bloom import known_emails
 from config import settings
+from db import SessionLocal, scalar_one_or_primary
 from models import User
+from revocation import revocation_list
 
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+def _build_pwd_context():
+    from passlib.context import CryptContext
+
+    # The first configured scheme hashes new passwords; the rest (and bcrypt,
+    # which existing hashes use) are kept for verification and marked deprecated
+    # so needs_update() flags them for rehash on the next successful login.
+    schemes = settings.password_schemes_list or ["bcrypt"]
+    if "bcrypt" not in schemes:
+        schemes.append("bcrypt")
+    options = {
+        "bcrypt__default_rounds": settings.bcrypt_rounds,
+        "bcrypt__min_rounds": settings.bcrypt_rounds,
+        "bcrypt__max_rounds": settings.bcrypt_rounds,
+    }
+    if "argon2" in schemes:
+        options.update(
+            argon2__type="ID",
+            argon2__time_cost=settings.argon2_time_cost,
+            argon2__memory_cost=settings.argon2_memory_cost,
+            argon2__parallelism=settings.argon2_parallelism,
+        )
+    return CryptContext(schemes=schemes, deprecated="auto", **options)
+
+
+_pwd_context = None
+
+
+def get_pwd_context():
+    # passlib loads its handlers (and the argon2/bcrypt backends) on import;
+    # build the context on the first password operation instead.
+    global _pwd_context
+    if _pwd_context is None:
+        _pwd_context = _build_pwd_context()
+    return _pwd_context
+
+
+def _new_hash_executor() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=settings.password_hash_workers, thread_name_prefix="pidp-hash")
+
+
+# Password hashing is CPU-bound; a dedicated pool keeps it off the event loop
+# and caps how many cores logins can consume at once.
+_hash_executor = _new_hash_executor()
+_dummy_hash: str | None = None
+# Verified claims keyed by token digest, so repeat presentations of the same
+# token skip signature verification until it expires.
+_verified_claims: OrderedDict[bytes, dict] = OrderedDict()
 _jwt_private_key = None
 _jwt_public_key = None
 _jwt_kid = None
@@ -31,6 +83,9 @@ def _load_or_generate_keys():
         _jwt_public_key = settings.jwt_public_key
     else:
         # Dev fallback: generate ephemeral RSA keypair if none provided.
+        from cryptography.hazmat.primitives import serialization
+        from cryptography.hazmat.primitives.asymmetric import rsa
+
         private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
         public_key = private_key.public_key()
         _jwt_private_key = private_key.private_bytes(
@@ -50,21 +105,58 @@ def _load_or_generate_keys():
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    return get_pwd_context().verify(plain_password, hashed_password)
 
 
 def hash_password(password: str) -> str:
     # bcrypt only considers the first 72 bytes; truncate to avoid runtime errors.
-    if len(password.encode("utf-8")) > 72:
+    if get_pwd_context().default_scheme() == "bcrypt" and len(password.encode("utf-8")) > 72:
         password = password.encode("utf-8")[:72].decode("utf-8", errors="ignore")
-    return pwd_context.hash(password)
+    return get_pwd_context().hash(password)
 
 
-def create_access_token(subject: str, email: str | None = None) -> str:
-    expire = datetime.utcnow() + timedelta(minutes=settings.access_token_expire_minutes)
-    payload = {"sub": subject, "exp": expire}
-    if email:
-        payload["email"] = email
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_hash_executor, verify_password, plain_password, hashed_password)
+
+
+async def hash_password_async(password: str) -> str:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_hash_executor, hash_password, password)
+
+
+def close_hash_executor() -> None:
+    global _hash_executor
+    # Requests have finished by now; do not block the loop on stray jobs.
+    _hash_executor.shutdown(wait=False, cancel_futures=True)
+    # Threads start on first use, so the replacement costs nothing unless
+    # the app is started again in this process (as tests do).
+    _hash_executor = _new_hash_executor()
+
+
+def password_needs_rehash(hashed_password: str) -> bool:
+    return get_pwd_context().needs_update(hashed_password)
+
+
+async def rehash_password(user_id, password: str, old_hash: str) -> None:
+    """Re-hash a verified password with the current scheme and cost.
+
+    Meant to run after the login response has been sent. The update is
+    conditional on the old hash so a concurrent password change wins.
+    """
+    new_hash = await hash_password_async(password)
+    async with SessionLocal() as session:
+        await session.execute(
+            update(User)
+            .where(User.id == user_id, User.hashed_password == old_hash)
+            .values(hashed_password=new_hash)
+        )
+        await session.commit()
+
+
+def _encode_token(payload: dict) -> str:
+    payload["iat"] = datetime.utcnow()
+    payload["jti"] = uuid.uuid4().hex
     if settings.jwt_issuer:
         payload["iss"] = settings.jwt_issuer
     if settings.jwt_audience:
@@ -76,12 +168,57 @@ def create_access_token(subject: str, email: str | None = None) -> str:
     return jwt.encode(payload, settings.secret_key, algorithm=settings.token_algorithm)
 
 
+def create_access_token(subject: str, email: str | None = None) -> str:
+    expire = datetime.utcnow() + timedelta(minutes=settings.access_token_expire_minutes)
+    payload = {"sub": subject, "exp": expire}
+    if email:
+        payload["email"] = email
+    return _encode_token(payload)
+
+
+def create_client_token(client_id: str, scopes: list[str]) -> tuple[str, datetime, str]:
+    """Return ``(token, expiry, jti)``."""
+    expire = datetime.utcnow() + timedelta(minutes=settings.client_token_expire_minutes)
+    payload = {"sub": f"client:{client_id}", "client_id": client_id, "scope": " ".join(scopes), "exp": expire}
+    token = _encode_token(payload)
+    return token, expire, payload["jti"]
+
+
+def hash_client_secret(secret: str) -> str:
+    # Client secrets are random 256-bit values, so a keyed fast hash is as
+    # strong as bcrypt here and costs microseconds instead of ~100ms.
+    pepper = (settings.client_secret_pepper or settings.secret_key).encode("utf-8")
+    return hmac.new(pepper, secret.encode("utf-8"), hashlib.sha256).hexdigest()
+
+
+def verify_client_secret(secret: str, secret_hash: str) -> bool:
+    return hmac.compare_digest(hash_client_secret(secret), secret_hash)
+
+
+async def _reject_unknown(password: str) -> None:
+    # Spend one hash, as a real verify does, so every failed login costs the
+    # same CPU. A Bloom filter miss also skips the user lookup, so unknown
+    # emails still answer about one database round trip sooner than known
+    # ones; turn off LOGIN_BLOOM_ENABLED where that difference matters.
+    global _dummy_hash
+    if not settings.login_dummy_hash:
+        return
+    if _dummy_hash is None:
+        _dummy_hash = await hash_password_async("pidp-dummy-password")
+    await verify_password_async(password, _dummy_hash)
+
+
 async def authenticate_user(session: AsyncSession, email: str, password: str) -> User | None:
-    result = await session.execute(select(User).where(User.email == email))
-    user = result.scalar_one_or_none()
+    if not await known_emails.might_exist(email):
+        await _reject_unknown(password)
+        return None
+    user = await scalar_one_or_primary(session, select(User).where(User.email == email))
     if not user or not user.hashed_password:
+        await _reject_unknown(password)
         return None
-    if not verify_password(password, user.hashed_password):
+    if not await verify_password_async(password, user.hashed_password):
+        return None
+    if not user.is_active:
         return None
     return user
 
@@ -103,11 +240,41 @@ async def get_user_by_id(session: AsyncSession, user_id: str) -> User | None:
     return result.scalar_one_or_none()
 
 
+def decode_token_cached(token: str) -> dict:
+    key = hashlib.blake2b(token.encode("utf-8"), digest_size=16).digest()
+    claims = _verified_claims.get(key)
+    if claims is not None:
+        if claims.get("exp", float("inf")) > time.time():
+            _verified_claims.move_to_end(key)
+            return claims
+        del _verified_claims[key]
+    claims = decode_token(token)
+    _verified_claims[key] = claims
+    if len(_verified_claims) > settings.verified_token_cache_size:
+        _verified_claims.popitem(last=False)
+    return claims
+
+
 def safe_decode_token(token: str) -> dict | None:
     try:
-        return decode_token(token)
+        claims = decode_token_cached(token)
     except JWTError:
         return None
+    if settings.token_revocation_enabled and revocation_list.is_revoked(claims):
+        return None
+    return claims
+
+
+def introspect_token(token: str) -> dict:
+    """RFC 7662 introspection response for ``token``."""
+    claims = safe_decode_token(token)
+    if not claims:
+        return {"active": False}
+    response = {"active": True, "token_type": "Bearer"}
+    for claim in ("sub", "client_id", "scope", "email", "exp", "iat", "iss", "aud", "jti"):
+        if claim in claims:
+            response[claim] = claims[claim]
+    return response
 
 
 def get_jwks() -> dict:
@@ -0,0 +1,149 @@
+"""Incremental rendering of ``.template`` / ``.default`` / ``.copy`` files.
+
+Every ``$NAME`` for a variable defined in the env module is replaced in a single
+regex pass. Longer names are matched first, so ``$PIDP_BASE_ADDR`` is never
+treated as ``$PIDP_BASE`` followed by ``_ADDR``. A manifest stored next to the
+tree records, for each template, its mtime and size, a hash of the values it
+used together with the set of defined names, and the mtime and size of its
+output. A template whose entry still matches is skipped without being read;
+defining or removing a variable, or editing or deleting an output, renders
+again. Outputs are written only when their content actually changes, so
+reloaders watching the tree are not triggered for nothing.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import re
+import shutil
+
+
+MANIFEST_NAME = ".substitutions.json"
+SKIP_DIRS = {".git", "__pycache__", "node_modules", ".venv", "venv", ".tox", ".nox", ".mypy_cache", ".pytest_cache"}
+
+
+def env_values(env) -> dict[str, str]:
+    """Substitutable variables of an env module (or any object with ``vars``)."""
+    return {name: str(value) for name, value in vars(env).items() if not name.startswith("__")}
+
+
+class Renderer:
+    def __init__(self, values: dict[str, str]):
+        self.values = values
+        # A newly defined name can change how ``$NAME...`` splits in any
+        # template, so every fingerprint covers the full set of names.
+        self._names = hashlib.sha256("\0".join(sorted(values)).encode("utf-8")).hexdigest()
+        names = sorted(values, key=len, reverse=True)
+        self.pattern = re.compile(r"\$(" + "|".join(map(re.escape, names)) + ")") if names else None
+
+    def render(self, text: str, used: set[str]) -> str:
+        if self.pattern is None:
+            return text
+
+        def replace(match: re.Match) -> str:
+            used.add(match.group(1))
+            return self.values[match.group(1)]
+
+        return self.pattern.sub(replace, text)
+
+    def fingerprint(self, names) -> str:
+        digest = hashlib.sha256(self._names.encode("ascii"))
+        for name in sorted(names):
+            digest.update(f"{name}\0{self.values.get(name)}\0".encode("utf-8"))
+        return digest.hexdigest()
+
+
+def _write_if_changed(path: str, text: str) -> bool:
+    data = text.encode("utf-8")
+    try:
+        with open(path, "rb") as f:
+            if f.read() == data:
+                return False
+    except FileNotFoundError:
+        pass
+    with open(path, "wb") as f:
+        f.write(data)
+    return True
+
+
+def _output_matches(entry: dict) -> bool:
+    try:
+        stat = os.stat(entry["output"])
+    except OSError:
+        return False
+    return stat.st_mtime_ns == entry.get("output_mtime_ns") and stat.st_size == entry.get("output_size")
+
+
+def _render_file(renderer: Renderer, path: str, suffix: str, manifest: dict, log) -> None:
+    used: set[str] = set()
+    output = renderer.render(path[: -len(suffix)], used)  # the filename is templated too
+    if suffix == ".default" and os.path.exists(output):
+        return  # defaults are only a starting point; never overwrite edits
+    stat = os.stat(path)
+    entry = manifest.get(path)
+    if (
+        entry
+        and entry["mtime_ns"] == stat.st_mtime_ns
+        and entry["size"] == stat.st_size
+        and entry["fingerprint"] == renderer.fingerprint(entry["names"])
+        and _output_matches(entry)
+    ):
+        return
+    with open(path, "r") as f:
+        text = renderer.render(f.read(), used)
+    if _write_if_changed(output, text):
+        log(f"Rendered {path} -> {output}")
+    output_stat = os.stat(output)
+    manifest[path] = {
+        "mtime_ns": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "names": sorted(used),
+        "fingerprint": renderer.fingerprint(used),
+        "output": output,
+        "output_mtime_ns": output_stat.st_mtime_ns,
+        "output_size": output_stat.st_size,
+    }
+
+
+def render_tree(root: str, values: dict[str, str], manifest_path: str | None = None, log=print) -> None:
+    """Render every template under ``root`` whose source or inputs changed."""
+    root = os.path.abspath(root)
+    if manifest_path is None:
+        manifest_path = os.path.join(root if os.path.isdir(root) else os.path.dirname(root), MANIFEST_NAME)
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, ValueError):
+        manifest = {}
+    before = json.dumps(manifest, sort_keys=True)
+    renderer = Renderer(values)
+
+    if os.path.isdir(root):
+        paths = []
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = [name for name in dirnames if name not in SKIP_DIRS]
+            paths.extend(os.path.join(dirpath, name) for name in filenames)
+    else:
+        paths = [root]
+
+    for path in paths:
+        try:
+            if path.endswith(".template"):
+                _render_file(renderer, path, ".template", manifest, log)
+            elif path.endswith(".default"):
+                _render_file(renderer, path, ".default", manifest, log)
+            elif path.endswith(".copy"):
+                target = path[: -len(".copy")]
+                if not os.path.exists(target):
+                    log(f"Copying {path} to {target}")
+                    shutil.copy(path, target)
+        except OSError as exc:
+            log(f"Couldn't process {path}: {exc}")
+
+    # Forget templates that were deleted.
+    for path in [path for path in manifest if path.startswith(root) and not os.path.exists(path)]:
+        del manifest[path]
+    if json.dumps(manifest, sort_keys=True) != before:
+        with open(manifest_path, "w") as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The modules live at the repository root and read settings on import.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("SECRET_KEY", "test-secret")
+os.environ.setdefault("DATABASE_URL", "postgresql+asyncpg://localhost/test")
@@ -0,0 +1,121 @@
+import asyncio
+
+import pytest
+
+import admission
+from admission import AdmissionController, AdmissionMiddleware, Overloaded, RouteClass
+
+
+def _controller(max_concurrency=1, queue_size=4, queue_timeout=1.0):
+    return AdmissionController(
+        max_concurrency,
+        [
+            RouteClass("cheap", 0, max_concurrency, queue_size, queue_timeout),
+            RouteClass("standard", 1, max_concurrency, queue_size, queue_timeout),
+            RouteClass("expensive", 2, max_concurrency, queue_size, queue_timeout),
+            RouteClass("bulk", 3, 1, queue_size, queue_timeout),
+        ],
+    )
+
+
+def test_freed_slot_goes_to_the_highest_priority_waiter():
+    async def scenario():
+        controller = _controller()
+        cheap, standard, expensive = (controller.classes[name] for name in ("cheap", "standard", "expensive"))
+        await controller.acquire(standard)
+        admitted = []
+
+        async def request(route_class):
+            await controller.acquire(route_class)
+            admitted.append(route_class.name)
+
+        # The expensive request queues first, but the cheap one is woken first.
+        tasks = [asyncio.create_task(request(expensive))]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(request(cheap)))
+        await asyncio.sleep(0)
+        controller.release(standard, 0.0)
+        await asyncio.sleep(0.01)
+        assert admitted == ["cheap"]
+        controller.release(cheap, 0.0)
+        await asyncio.gather(*tasks)
+        assert admitted == ["cheap", "expensive"]
+
+    asyncio.run(scenario())
+
+
+def test_full_queue_sheds_immediately():
+    async def scenario():
+        controller = _controller(queue_size=1)
+        standard = controller.classes["standard"]
+        await controller.acquire(standard)
+        queued = asyncio.create_task(controller.acquire(standard))
+        await asyncio.sleep(0)
+        with pytest.raises(Overloaded) as exc_info:
+            await controller.acquire(standard)
+        assert exc_info.value.retry_after >= 1
+        assert standard.shed == 1
+        controller.release(standard, 0.0)
+        await queued
+
+    asyncio.run(scenario())
+
+
+def test_queue_timeout_sheds_and_forgets_the_waiter():
+    async def scenario():
+        controller = _controller(queue_timeout=0.01)
+        standard = controller.classes["standard"]
+        await controller.acquire(standard)
+        with pytest.raises(Overloaded):
+            await controller.acquire(standard)
+        assert standard.shed == 1
+        assert not standard.waiters
+        assert controller.active == 1
+
+    asyncio.run(scenario())
+
+
+def test_timeout_gives_back_a_slot_granted_at_the_same_time(monkeypatch):
+    async def scenario():
+        controller = _controller()
+        standard = controller.classes["standard"]
+        await controller.acquire(standard)
+
+        async def grant_then_time_out(waiter, timeout):
+            controller.release(standard, 0.0)  # wakes and grants the waiter
+            assert waiter.done()
+            raise asyncio.TimeoutError
+
+        monkeypatch.setattr(admission.asyncio, "wait_for", grant_then_time_out)
+        with pytest.raises(Overloaded):
+            await controller.acquire(standard)
+        assert controller.active == 0
+        assert standard.active == 0
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def scenario():
+        controller = _controller()
+        standard = controller.classes["standard"]
+        await controller.acquire(standard)
+        queued = asyncio.create_task(controller.acquire(standard))
+        await asyncio.sleep(0)
+        queued.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await queued
+        assert not standard.waiters
+        controller.release(standard, 0.0)
+        assert controller.active == 0
+
+    asyncio.run(scenario())
+
+
+def test_bulk_transfers_do_not_take_expensive_slots():
+    middleware = AdmissionMiddleware(None, _controller())
+    assert middleware.classify("GET", "/admin/users/export").name == "bulk"
+    assert middleware.classify("POST", "/admin/users/import").name == "bulk"
+    assert middleware.classify("POST", "/auth/token").name == "expensive"
+    assert middleware.classify("GET", "/auth/me").name == "cheap"
+    assert middleware.classify("GET", "/health") is None